@@ -0,0 +1,253 @@
+import contextvars
+import heapq
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+from fleet_data import load_telemetry, load_tickets
+from settings import settings
+
+# Priority classes, most urgent first. Speculative calls (prefetches) are
+# below every real request and only ever use spare capacity.
+PRIORITY_CLASSES = ("urgent", "elevated", "routine", "speculative")
+URGENT, ELEVATED, ROUTINE, SPECULATIVE = range(len(PRIORITY_CLASSES))
+
+# Set while a prefetch runs so its agent calls are admitted as speculative
+speculative = contextvars.ContextVar("speculative", default=False)
+
+# Number of recent waits kept per priority class for metrics
+MAX_WAIT_SAMPLES = 1000
+
+
+def classify(alert_status=None, ticket_priorities=()):
+    """Map telemetry AlertStatus and ticket Priority values to a priority class."""
+    if alert_status == "Red" or "Immediate" in ticket_priorities:
+        return URGENT
+    if alert_status == "Yellow" or "4-6 hour response" in ticket_priorities:
+        return ELEVATED
+    return ROUTINE
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_token(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """Stop issuing tokens for a while, e.g. after an upstream 429."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class AdmissionController:
+    """Token bucket per agent ID with a priority queue of waiting callers.
+
+    A caller is admitted only when it is the most urgent (then oldest) waiter
+    for that agent and the agent's bucket has a token, so requests for
+    machines in a Red alert state or with Immediate tickets jump ahead of
+    routine checks instead of competing equally.
+
+    Waiting blocks a server worker thread, so at most max_waiters callers
+    may wait at once; beyond that non-urgent callers are refused instead of
+    queueing, which keeps threads free for urgent requests to reach the queue.
+    Speculative callers never wait: they are admitted only when nobody is
+    queued and the bucket would still have a token left for a real request.
+    """
+
+    def __init__(self, rate, burst, overrides=None, max_wait=None, max_waiters=None):
+        self.rate = rate
+        self.burst = burst
+        self.overrides = overrides or {}
+        self.max_wait = max_wait
+        self.max_waiters = max_waiters
+        self._waiting = 0
+        self._condition = threading.Condition()
+        self._buckets = {}
+        self._queues = {}
+        self._sequence = itertools.count()
+        self._vin_priorities = {}
+        # Inputs to a VIN's class, kept so it can be recomputed (and lowered)
+        self._alert_statuses = {}
+        self._ticket_priorities = {}
+        self._waits = {name: deque(maxlen=MAX_WAIT_SAMPLES) for name in PRIORITY_CLASSES}
+        self._admitted = {name: 0 for name in PRIORITY_CLASSES}
+        self._shed = {name: 0 for name in PRIORITY_CLASSES}
+        self.timed_out = 0
+        self.throttled = 0
+
+    # Priority lookup
+    def load_fleet(self, telemetry, tickets):
+        ticket_priorities = tickets.groupby("VinNumber")["Priority"].agg(set).to_dict()
+        alert_statuses = telemetry.set_index("VinNumber")["AlertStatus"].to_dict()
+        with self._condition:
+            self._alert_statuses.update(alert_statuses)
+            for vin, priorities in ticket_priorities.items():
+                self._ticket_priorities.setdefault(vin, set()).update(priorities)
+            for vin in set(ticket_priorities) | set(alert_statuses):
+                self._reclassify(vin)
+
+    def _reclassify(self, vin):
+        # Caller holds the condition
+        self._vin_priorities[vin] = classify(
+            self._alert_statuses.get(vin), self._ticket_priorities.get(vin, set())
+        )
+
+    def update_priority(self, vin, alert_status=None, ticket_priority=None):
+        """Recompute a VIN's priority from its current AlertStatus and all its ticket priorities.
+
+        A machine that reports Green again drops back unless its tickets
+        still call for a higher class.
+        """
+        with self._condition:
+            if alert_status is not None:
+                self._alert_statuses[vin] = alert_status
+            if ticket_priority:
+                self._ticket_priorities.setdefault(vin, set()).add(ticket_priority)
+            self._reclassify(vin)
+
+    def priority_for(self, vin):
+        if speculative.get():
+            return SPECULATIVE
+        with self._condition:
+            return self._vin_priorities.get(vin, ROUTINE)
+
+    # Admission
+    def _bucket(self, agent_id):
+        if agent_id not in self._buckets:
+            rate, burst = self.overrides.get(agent_id, (self.rate, self.burst))
+            self._buckets[agent_id] = TokenBucket(rate, burst)
+        return self._buckets[agent_id]
+
+    def admit(self, agent_id, priority):
+        """Block until the caller may call the agent. Returns False on timeout or when shed."""
+        start = time.monotonic()
+        entry = (priority, next(self._sequence))
+        name = PRIORITY_CLASSES[priority]
+        with self._condition:
+            queue = self._queues.setdefault(agent_id, [])
+            bucket = self._bucket(agent_id)
+            if priority == SPECULATIVE:
+                if not queue and bucket.time_until_token() <= 0 and bucket.tokens >= 2:
+                    bucket.take()
+                    self._waits[name].append(0.0)
+                    self._admitted[name] += 1
+                    return True
+                self._shed[name] += 1
+                return False
+            if not queue and bucket.time_until_token() <= 0:
+                bucket.take()
+                self._waits[name].append(0.0)
+                self._admitted[name] += 1
+                return True
+            if priority != URGENT and self.max_waiters is not None and self._waiting >= self.max_waiters:
+                self._shed[name] += 1
+                return False
+            heapq.heappush(queue, entry)
+            self._waiting += 1
+            try:
+                return self._wait(agent_id, queue, bucket, entry, name, start)
+            finally:
+                self._waiting -= 1
+
+    def _wait(self, agent_id, queue, bucket, entry, name, start):
+        # Caller holds the condition and has already queued entry
+        while True:
+            timeout = None
+            if queue[0] == entry:
+                timeout = bucket.time_until_token()
+                if timeout <= 0:
+                    bucket.take()
+                    heapq.heappop(queue)
+                    break
+            if self.max_wait is not None:
+                remaining = self.max_wait - (time.monotonic() - start)
+                if remaining <= 0:
+                    queue.remove(entry)
+                    heapq.heapify(queue)
+                    self.timed_out += 1
+                    self._condition.notify_all()
+                    return False
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            self._condition.wait(timeout)
+
+        # Let the next waiter re-check whether it is now at the head
+        self._condition.notify_all()
+        self._waits[name].append(time.monotonic() - start)
+        self._admitted[name] += 1
+        return True
+
+    def throttle(self, agent_id, seconds):
+        """Back off an agent after the upstream answered 429."""
+        with self._condition:
+            self._bucket(agent_id).pause(seconds)
+            self.throttled += 1
+
+    def metrics(self):
+        with self._condition:
+            classes = {}
+            for name in PRIORITY_CLASSES:
+                waits = sorted(self._waits[name])
+                classes[name] = {
+                    "admitted": self._admitted[name],
+                    "shed": self._shed[name],
+                    "wait_ms_avg": 1000 * sum(waits) / len(waits) if waits else 0.0,
+                    "wait_ms_p95": 1000 * waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+                    "wait_ms_max": 1000 * waits[-1] if waits else 0.0,
+                }
+            return {
+                "enabled": settings.ADMISSION_CONTROL_ENABLED,
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "max_waiters": self.max_waiters,
+                "waiting": self._waiting,
+                "queue_depth": {agent_id: len(queue) for agent_id, queue in self._queues.items()},
+                "priority_classes": classes,
+                "timed_out": self.timed_out,
+                "throttled": self.throttled,
+            }
+
+
+def build_admission_controller():
+    try:
+        overrides = {
+            agent_id: tuple(limits) for agent_id, limits in json.loads(settings.AGENT_RATE_LIMITS).items()
+        }
+    except (TypeError, ValueError) as e:
+        print(f"Ignoring invalid AGENT_RATE_LIMITS: {e}")
+        overrides = {}
+    controller = AdmissionController(
+        settings.AGENT_RATE_LIMIT_PER_SECOND,
+        settings.AGENT_RATE_LIMIT_BURST,
+        overrides,
+        settings.ADMISSION_MAX_WAIT_SECONDS,
+        settings.ADMISSION_MAX_WAITERS,
+    )
+    try:
+        controller.load_fleet(load_telemetry(), load_tickets())
+    except FileNotFoundError as e:
+        print(f"Admission control fleet data not found: {e}")
+    return controller
+
+
+admission_controller = build_admission_controller()
@@ -2,16 +2,36 @@ import json
 
 import requests
 
-from corrosion_detection import detect_corrosion
+from admission_control import admission_controller
+from image_batch import detect_and_read, merge_corrosion_findings, merge_notes, run_parallel
 from ocr_extraction import extract_text
+from semantic_cache import semantic_cache
 from settings import settings
+from telemetry_stream import telemetry_stream
+from ticket_analytics import ticket_analytics
 
 base_url = settings.AGENT_STUDIO_CHAT_URL
 feedback_url = settings.AGENT_LEARNING_FEEDBACK_URL
 feedback_rag_config_id = settings.FEEDBACK_RAG_ID
 
 
-def chat_with_agent(user_id, agent_id, session_id, message):
+def chat_with_agent(user_id, agent_id, session_id, message, vin=None, cache_text=None, context_version=None):
+    # Reuse the answer to a near-identical earlier issue for this agent and VIN.
+    # Only callers passing the VIN and the issue text take part; the cache
+    # compares that text, not the whole prompt.
+    use_cache = settings.SEMANTIC_CACHE_ENABLED and vin and cache_text
+    if use_cache:
+        cached_response = semantic_cache.lookup(agent_id, vin, cache_text, context_version)
+        if cached_response is not None:
+            return cached_response
+
+    # Wait for a rate-limit token; urgent machines (by VIN) are admitted first
+    if settings.ADMISSION_CONTROL_ENABLED:
+        priority = admission_controller.priority_for(vin)
+        if not admission_controller.admit(agent_id, priority):
+            print(f"Admission refused for agent {agent_id}")
+            return None
+
     url = base_url
     headers = {
         "Content-Type": "application/json",
@@ -29,15 +49,23 @@ def chat_with_agent(user_id, agent_id, session_id, message):
     try:
         response = requests.request("POST", url, headers=headers, data=payload)
         response.raise_for_status()
-        return response.json()
+        result = response.json()
     except requests.exceptions.HTTPError as http_err:
         print(f"HTTP error occurred: {http_err}")
+        if settings.ADMISSION_CONTROL_ENABLED and http_err.response.status_code == 429:
+            retry_after = http_err.response.headers.get("Retry-After", "1")
+            admission_controller.throttle(agent_id, float(retry_after) if retry_after.isdigit() else 1.0)
         return None
     except Exception as err:
         print(f"Other error occurred: {err}")
         return None
+
+    if use_cache:
+        semantic_cache.store(agent_id, vin, cache_text, result, context_version)
+    return result
     
-def send_feedback(user_input, agent_output, feedback, agent_id):
+def send_feedback(user_input, agent_output, feedback, agent_id, raise_errors=False):
+    # raise_errors lets the feedback spool tell a rejected record from an outage
     url = feedback_url + "?feedback_rag_config_id=" + feedback_rag_config_id + "&agent_id=" + agent_id
     headers = {
         "Content-Type": "application/json",
@@ -56,9 +84,13 @@ def send_feedback(user_input, agent_output, feedback, agent_id):
         return response.json()
     except requests.exceptions.HTTPError as http_err:
         print(f"HTTP error occurred: {http_err}")
+        if raise_errors:
+            raise
         return None
     except Exception as err:
         print(f"Other error occurred: {err}")
+        if raise_errors:
+            raise
         return None
 
 
@@ -70,6 +102,8 @@ def troubleshoot_issue(
     ticket_analysis,
     kg_analysis_output,
     handwritten_analysis,
+    nearby_context=None,
+    vin=None,
 ):
     message = (
         "Issue Description: "
@@ -85,12 +119,15 @@ def troubleshoot_issue(
         + "\nKnowledge Graph Analysis: "
         + str(kg_analysis_output)
     )
+    if nearby_context:
+        message += "\nNearby Machines: " + nearby_context
 
     troubleshooting_agent_output = chat_with_agent(
         user_id="default",
         agent_id=settings.TROUBLESHOOTING_AGENT_ID,
         session_id=session_id,
         message=message,
+        vin=vin,
     )
 
     if troubleshooting_agent_output:
@@ -102,41 +139,67 @@ def troubleshoot_issue(
 
 def generate_telemetry_analysis(session_id, vin, issue_desc):
     message = "Issue Description: " + issue_desc + "\nVIN: " + vin
+    # Rolling aggregates from streamed telemetry, read without rescanning history
+    telemetry_version = telemetry_stream.version(vin)
+    current_state = telemetry_stream.summary(vin)
+    if current_state:
+        message += "\nCurrent Telemetry:\n" + current_state
     telemetry_anlysis_agent_output = chat_with_agent(
         user_id="default",
         agent_id=settings.TELEMETRY_AGENT_ID,
         session_id=session_id,
         message=message,
+        vin=vin,
+        cache_text=issue_desc,
+        context_version=telemetry_version,
     )
 
+    # The similarity is returned so callers can mark a reused answer
     if telemetry_anlysis_agent_output:
         final_output = telemetry_anlysis_agent_output["response"]
-        return final_output
+        return final_output, telemetry_anlysis_agent_output.get("similarity")
     else:
-        return "Error: Unable to analyze telemetry data."
+        return "Error: Unable to analyze telemetry data.", None
 
 
 def generate_ticket_history_analysis(session_id, issue_desc, vin):
     message = "Issue Description: " + issue_desc + "\nVIN: " + vin
+    # Recurrence and MTBF computed locally, so the agent interprets rather than counts
+    ticket_version = ticket_analytics.version(vin)
+    recurrence = ticket_analytics.summary(vin)
+    if recurrence:
+        message += "\nTicket Recurrence Analysis:\n" + recurrence
 
     ticket_analysis_agent_output = chat_with_agent(
         user_id="default",
         agent_id=settings.TICKET_AGENT_ID,
         session_id=session_id,
         message=message,
+        vin=vin,
+        cache_text=issue_desc,
+        context_version=ticket_version,
     )
 
     if ticket_analysis_agent_output:
         final_output = ticket_analysis_agent_output["response"]
-        return final_output
+        return final_output, ticket_analysis_agent_output.get("similarity")
     else:
-        return "Error: Unable to analyze ticket history."
+        return "Error: Unable to analyze ticket history.", None
 
 
-def generate_corrosion_analysis(session_id, issue_desc, image_path=None):
-
-    corrosion_analysis_file_path = detect_corrosion(image_path)
-    corrosion_text = extract_text(corrosion_analysis_file_path)
+def generate_corrosion_analysis(session_id, issue_desc, image_path=None, nearby_context=None, vin=None):
+    # image_path may be a list of photos: they are detected and read in
+    # parallel and merged, so the agent is still called once
+    image_paths = image_path if isinstance(image_path, (list, tuple)) else [image_path]
+    results = run_parallel(detect_and_read, enumerate(image_paths))
+    detected_paths = [path for path, _ in results if path]
+    texts = [text for _, text in results]
+    if isinstance(image_path, (list, tuple)):
+        corrosion_analysis_file_path = detected_paths
+        corrosion_text = merge_corrosion_findings(texts) if any(texts) else None
+    else:
+        corrosion_analysis_file_path = detected_paths[0] if detected_paths else None
+        corrosion_text = texts[0]
 
     input_message = (
         "Corrosion Analysis: "
@@ -144,18 +207,23 @@ def generate_corrosion_analysis(session_id, issue_desc, image_path=None):
         + "\nIssue Description: "
         + str(issue_desc)
     )
+    # Atmospheric corrosion clusters geographically
+    if nearby_context:
+        input_message += "\nNearby Machines: " + nearby_context
+    corrosion_analysis = None
     if corrosion_text:
         corrosion_analysis = chat_with_agent(
             user_id="default",
             agent_id=settings.CORROSION_AGENT_ID,
             session_id=session_id,
             message=input_message,
+            vin=vin,
         )
     if corrosion_analysis:
         final_output = corrosion_analysis["response"]
         return corrosion_analysis_file_path, final_output
     else:
-        return "Error: Unable to process image"
+        return corrosion_analysis_file_path, "Error: Unable to process image"
 
 
 def analyse_knowledge_graph_data(session_id, prompt):
@@ -173,23 +241,30 @@ def analyse_knowledge_graph_data(session_id, prompt):
         return "Error: Unable to process KG data"
 
 
-def analyse_handwritten_data(session_id, issue_desc, image_path=None):
+def analyse_handwritten_data(session_id, issue_desc, image_path=None, vin=None):
     if not image_path:
         image_path = "data/handwritten.jpg"
 
-    handwritten_text = extract_text(image_path)
+    # Several pages of notes are read in parallel and sent as one message
+    if isinstance(image_path, (list, tuple)):
+        texts = run_parallel(extract_text, image_path)
+        handwritten_text = merge_notes(texts) if any(texts) else None
+    else:
+        handwritten_text = extract_text(image_path)
+    ocr_analysis = None
     if handwritten_text:
         ocr_analysis = chat_with_agent(
             user_id="default",
             agent_id=settings.OCR_AGENT_ID,
             session_id=session_id,
             message=str(handwritten_text) + str(issue_desc),
+            vin=vin,
         )
     if ocr_analysis:
         final_output = ocr_analysis["response"]
         return handwritten_text, final_output, image_path
     else:
-        return "Error: Unable to process image"
+        return handwritten_text, "Error: Unable to process image", image_path
 
 
 def generate_manager_analysis(session_id, issue_desc, troubleshooting_steps, vin):
@@ -206,33 +281,10 @@ def generate_manager_analysis(session_id, issue_desc, troubleshooting_steps, vin
         agent_id=settings.MANAGER_AGENT_ID,
         session_id=session_id,
         message=message,
+        vin=vin,
     )
     if manager_analysis:
         final_output = manager_analysis["response"]
         return final_output
     else:
         return "Error: Unable to process manager analysis"
-
-def send_feedback(user_input, agent_output, feedback, agent_id):
-    url = feedback_url + "?feedback_rag_config_id=" + feedback_rag_config_id + "&agent_id=" + agent_id
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": settings.LYZR_API_KEY,
-    }
-    payload = json.dumps(
-        {
-            "feedback": feedback,
-            "user_input": user_input,
-            "agent_output": agent_output,
-        }
-    )
-    try:
-        response = requests.request("POST", url, headers=headers, data=payload)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.HTTPError as http_err:
-        print(f"HTTP error occurred: {http_err}")
-        return None
-    except Exception as err:
-        print(f"Other error occurred: {err}")
-        return None
\ No newline at end of file
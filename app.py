@@ -1,7 +1,9 @@
+import contextvars
 import os
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import pandas as pd
 import streamlit as st
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,11 +16,88 @@ from agent import (
     generate_ticket_history_analysis,
     troubleshoot_issue,
 )
+from image_batch import batch_upload_path, remove_stale_uploads, upload_paths
+from knowledge_graph import knowledge_graph
+from profiling import profile_block, profiled, profiling_requested
+from spatial_index import spatial_index
+from step_cache import file_sha256, is_error
+from telemetry_stream import telemetry_stream
+from ticket_analytics import ticket_analytics
+
+CORROSION_UPLOAD_PATH = "data/corrosion_upload.jpg"
+HANDWRITING_UPLOAD_PATH = "data/handwriting_upload.jpg"
+# Maximum number of memoized step results kept per browser session
+MAX_CACHED_RESULTS = 64
 
 if "session_id" not in st.session_state:
     st.session_state.session_id = "accenture_temp_session123"
     st.write("Session ID:", st.session_state.session_id)
 
+if "step_results" not in st.session_state:
+    st.session_state.step_results = OrderedDict()
+
+
+def save_upload(uploaded_file, path):
+    with open(path, "wb") as f:
+        f.write(uploaded_file.getvalue())
+
+
+def save_uploads(uploaded_files, path):
+    for index, uploaded_file in enumerate(uploaded_files):
+        save_upload(uploaded_file, batch_upload_path(path, index))
+    remove_stale_uploads(path, len(uploaded_files))
+
+
+def cached_result(key):
+    results = st.session_state.step_results
+    if key in results:
+        results.move_to_end(key)
+        return results[key]
+    return None
+
+
+def store_result(key, result):
+    # Don't pin failed agent calls; the next run should retry them
+    if is_error(result):
+        return
+    results = st.session_state.step_results
+    results[key] = result
+    results.move_to_end(key)
+    while len(results) > MAX_CACHED_RESULTS:
+        results.popitem(last=False)
+
+
+def render_reuse(similarity):
+    if similarity is not None:
+        st.caption(f"Reused the answer to a similar earlier issue (similarity {similarity:.2f})")
+
+
+def render_telemetry(result):
+    telemetry_analysis, similarity = result
+    st.subheader("Agent Analysis (Telemetry):")
+    render_reuse(similarity)
+    st.write(telemetry_analysis)
+
+
+def render_corrosion(result):
+    final_image_path, corrosion_analysis_result = result
+    if final_image_path:
+        st.image(final_image_path)
+    st.write(corrosion_analysis_result)
+
+
+def render_ticket(result):
+    ticket_analysis, similarity = result
+    st.subheader("Agent Analysis (Ticket History):")
+    render_reuse(similarity)
+    st.write(ticket_analysis)
+
+
+def render_handwritten(result):
+    handwritten_text, handwritten_analysis, image_path = result
+    st.image(image_path)
+    st.write(handwritten_analysis)
+
 
 # Streamlit UI
 def main():
@@ -28,19 +107,19 @@ def main():
     vin = st.text_input("Enter VIN Number:")
     issue_desc = st.text_area("Explain the issue:")
 
-    # Corrosion image
-    corrosion_uploaded_image = st.file_uploader("Corrosion image:", type=["jpg", "png"])
-    if corrosion_uploaded_image:
-        with open(f"data/corrosion_upload.jpg", "wb") as f:
-            f.write(corrosion_uploaded_image.read())
+    # Corrosion images (one or more panels)
+    corrosion_uploaded_images = st.file_uploader(
+        "Corrosion images:", type=["jpg", "png"], accept_multiple_files=True
+    )
+    if corrosion_uploaded_images:
+        save_uploads(corrosion_uploaded_images, CORROSION_UPLOAD_PATH)
 
-    # Handwriting Image
-    handwriting_uploaded_image = st.file_uploader(
-        "Handwriting image:", type=["jpg", "png"]
+    # Handwriting images (one or more pages)
+    handwriting_uploaded_images = st.file_uploader(
+        "Handwriting images:", type=["jpg", "png"], accept_multiple_files=True
     )
-    if handwriting_uploaded_image:
-        with open(f"data/handwriting_upload.jpg", "wb") as f:
-            f.write(handwriting_uploaded_image.read())
+    if handwriting_uploaded_images:
+        save_uploads(handwriting_uploaded_images, HANDWRITING_UPLOAD_PATH)
 
     if st.button("Troubleshoot"):
         if not vin:
@@ -49,71 +128,148 @@ def main():
         if not issue_desc:
             st.error("Please enter the detailed issue description.")
 
-        try:
-            # Get telemetry data
-            st.header("Step 1: Telemetry Data")
-            telemetry_analysis = generate_telemetry_analysis(
-                st.session_state.session_id,
-                vin,
-                issue_desc,
-            )
-            st.subheader("Agent Analysis (Telemetry):")
-            st.write(telemetry_analysis)
+        if not vin or not issue_desc:
+            return
 
-            st.header("Step 2: Vision Inspection Data")
-            final_image_path, corrosion_analysis_result = generate_corrosion_analysis(
-                st.session_state.session_id, issue_desc, "data/corrosion_upload.jpg"
-            )
-            st.image(final_image_path)
-            st.write(corrosion_analysis_result)
+        session_id = st.session_state.session_id
+        corrosion_paths = upload_paths(CORROSION_UPLOAD_PATH) or [CORROSION_UPLOAD_PATH]
+        handwriting_paths = upload_paths(HANDWRITING_UPLOAD_PATH) or [HANDWRITING_UPLOAD_PATH]
+        corrosion_hash = tuple(file_sha256(path) for path in corrosion_paths)
+        handwriting_hash = tuple(file_sha256(path) for path in handwriting_paths)
+        corrosion_nearby = spatial_index.nearby_context(vin, "corrosion")
+        # Neighbours' findings change on each of their runs, so keys use the stable form
+        corrosion_nearby_key = spatial_index.nearby_context(vin, "corrosion", findings=False)
+        telemetry_version = telemetry_stream.version(vin)
+        ticket_version = ticket_analytics.version(vin)
 
-            # Get ticket history
-            st.header("Step 3: Ticket History")
-            ticket_analysis = generate_ticket_history_analysis(
-                st.session_state.session_id, issue_desc, vin
-            )
-            st.subheader("Agent Analysis (Ticket History):")
-            st.write(ticket_analysis)
-
-            # st.header("Step 4: Knowledge Graph Data")
-            # kg_analysis_output = extract_steps_from_kg(
-            #     st.session_state.session_id, issue_desc
-            # )
-            # # Print the analysis output
-            # st.write(kg_analysis_output)
-
-            st.header("Step 5: Handwritten data analysis")
-            handwritten_text, handwritten_analysis, image_path = (
-                analyse_handwritten_data(
-                    st.session_state.session_id,
-                    issue_desc,
-                    "data/handwriting_upload.jpg",
-                )
+        # Independent steps: (key, header, agent call, args, renderer)
+        independent_steps = [
+            (
+                ("telemetry", vin, issue_desc, telemetry_version),
+                "Step 1: Telemetry Data",
+                generate_telemetry_analysis,
+                (session_id, vin, issue_desc),
+                render_telemetry,
+            ),
+            (
+                ("corrosion", vin, issue_desc, corrosion_hash, corrosion_nearby_key),
+                "Step 2: Vision Inspection Data",
+                generate_corrosion_analysis,
+                (session_id, issue_desc, corrosion_paths, corrosion_nearby, vin),
+                render_corrosion,
+            ),
+            (
+                ("ticket", vin, issue_desc, ticket_version),
+                "Step 3: Ticket History",
+                generate_ticket_history_analysis,
+                (session_id, issue_desc, vin),
+                render_ticket,
+            ),
+            (
+                ("handwritten", vin, issue_desc, handwriting_hash),
+                "Step 5: Handwritten data analysis",
+                analyse_handwritten_data,
+                (session_id, issue_desc, handwriting_paths, vin),
+                render_handwritten,
+            ),
+        ]
+
+        # Lay out every section up front so results can fill them in any order
+        placeholders = {}
+        for key, header, _, _, _ in independent_steps:
+            st.header(header)
+            placeholders[key] = st.empty()
+            placeholders[key].info("Running analysis...")
+
+        results = {}
+        failed = False
+        with ThreadPoolExecutor(max_workers=len(independent_steps)) as executor:
+            futures = {}
+            for key, _, agent_call, args, renderer in independent_steps:
+                result = cached_result(key)
+                if result is not None:
+                    results[key] = result
+                    with placeholders[key].container():
+                        renderer(result)
+                else:
+                    # Run in a copy of this context so an active profile samples the worker
+                    context = contextvars.copy_context()
+                    futures[executor.submit(context.run, profiled(agent_call), *args)] = (key, renderer)
+
+            # Streamlit calls must stay on the script thread: workers only call agents
+            for future in as_completed(futures):
+                key, renderer = futures[future]
+                try:
+                    result = future.result()
+                    with placeholders[key].container():
+                        renderer(result)
+                except Exception as e:
+                    failed = True
+                    placeholders[key].error(f"An error occurred: {str(e)}")
+                    continue
+                results[key] = result
+                store_result(key, result)
+
+        if failed:
+            st.error("Troubleshooting skipped because one or more analyses failed.")
+            return
+
+        try:
+            telemetry_analysis, _ = results[independent_steps[0][0]]
+            _, corrosion_analysis_result = results[independent_steps[1][0]]
+            ticket_analysis, _ = results[independent_steps[2][0]]
+            _, handwritten_analysis, _ = results[independent_steps[3][0]]
+
+            st.header("Step 4: Knowledge Graph Data")
+            kg_analysis_output = knowledge_graph.analyse(vin, issue_desc)
+            st.text(kg_analysis_output)
+            nearby_context = spatial_index.nearby_context(vin)
+            nearby_key = spatial_index.nearby_context(vin, findings=False)
+            # The keys below don't cover upstream results, so an answer built
+            # on a failed step must not be memoized; rerunning retries both
+            upstream_failed = any(
+                is_error(result)
+                for result in (telemetry_analysis, corrosion_analysis_result, ticket_analysis, handwritten_analysis)
             )
-            st.image(image_path)
-            st.write(handwritten_analysis)
 
             # Troubleshoot
-            kg_analysis_output = "Knowledge Graph analysis not available"
             st.header("Step 6: Troubleshooting Steps")
-            troubleshooting_steps = troubleshoot_issue(
-                st.session_state.session_id,
-                issue_desc,
-                telemetry_analysis,
-                corrosion_analysis_result,
-                ticket_analysis,
-                kg_analysis_output,
-                handwritten_analysis,
+            troubleshoot_key = (
+                "troubleshoot", vin, issue_desc, corrosion_hash, handwriting_hash,
+                kg_analysis_output, nearby_key, telemetry_version, ticket_version,
             )
+            troubleshooting_steps = cached_result(troubleshoot_key)
+            if troubleshooting_steps is None:
+                troubleshooting_steps = troubleshoot_issue(
+                    session_id,
+                    issue_desc,
+                    telemetry_analysis,
+                    corrosion_analysis_result,
+                    ticket_analysis,
+                    kg_analysis_output,
+                    handwritten_analysis,
+                    nearby_context,
+                    vin=vin,
+                )
+                if not upstream_failed:
+                    store_result(troubleshoot_key, troubleshooting_steps)
             st.write(troubleshooting_steps)
 
             st.header("Step 7: Manager Analysis")
-            manager_analysis = generate_manager_analysis(
-                st.session_state.session_id,
-                issue_desc,
-                troubleshooting_steps,
-                vin,
+            manager_key = (
+                "manager", vin, issue_desc, corrosion_hash, handwriting_hash,
+                kg_analysis_output, nearby_key, telemetry_version, ticket_version,
             )
+            manager_analysis = cached_result(manager_key)
+            if manager_analysis is None:
+                manager_analysis = generate_manager_analysis(
+                    session_id,
+                    issue_desc,
+                    troubleshooting_steps,
+                    vin,
+                )
+                if not upstream_failed and not is_error(troubleshooting_steps):
+                    store_result(manager_key, manager_analysis)
             st.write(manager_analysis)
 
         except Exception as e:
@@ -121,4 +277,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # Append ?profile=<PROFILING_ADMIN_TOKEN> to the app URL to sample this
+    # rerun into the profile store
+    if profiling_requested(st.query_params.get("profile")):
+        with profile_block("streamlit rerun"):
+            main()
+    else:
+        main()
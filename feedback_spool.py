@@ -0,0 +1,321 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+
+from agent import send_feedback
+from settings import settings
+
+# Outcomes of one delivery attempt
+SENT, REJECTED, FAILED = "sent", "rejected", "failed"
+# Client errors that are worth retrying rather than treating as a rejection
+RETRYABLE_STATUS_CODES = (408, 429)
+
+
+class FeedbackSpool:
+    """Append-only local spool for feedback, flushed upstream in the background.
+
+    Every submission is appended (and fsynced) to a JSONL file before it is
+    acknowledged. A flusher thread reads pending records from the committed
+    byte offset, sends them in order with retries and only then advances
+    the offset, so nothing is lost across restarts. The upstream endpoint
+    takes one record per POST, so a "batch" is the number of records read
+    and committed per pass, not one request.
+
+    When a send fails the flush stops at that record and the next interval
+    tries again, so an outage only delays delivery. A record is moved to a
+    dead-letter file only when the upstream rejects it (a 4xx), or when it
+    has kept failing for dead_letter_after seconds. The time of its first
+    failure is persisted, so that limit counts across flushes and restarts.
+    """
+
+    def __init__(self, path, flush_interval, batch_size, max_retries, dead_letter_after):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.dead_letter_path = path + ".dead"
+        self.head_failure_path = path + ".head"
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.dead_letter_after = dead_letter_after
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.sent_count = 0
+        self.failed_attempts = 0
+        self.skipped_count = 0
+        self.dead_letter_count = 0
+        self.last_flush_at = None
+        self.last_error = None
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._offset = self._read_offset()
+        self._pending = self._count_pending()
+        # {"offset", "first_failed_at", "attempts"} for the record delivery is stuck on
+        self._head_failure = self._read_head_failure()
+
+    # Offset bookkeeping
+    def _read_offset(self):
+        try:
+            with open(self.offset_path, "r", encoding="utf-8") as f:
+                offset = int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+        try:
+            spool_size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            spool_size = 0
+        return offset if offset <= spool_size else 0
+
+    def _write_offset(self, offset):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+        self._offset = offset
+
+    def _read_head_failure(self):
+        try:
+            with open(self.head_failure_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_head_failure(self, state):
+        tmp_path = self.head_failure_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.head_failure_path)
+        self._head_failure = state
+
+    def _clear_head_failure(self):
+        if self._head_failure is None:
+            return
+        try:
+            os.remove(self.head_failure_path)
+        except FileNotFoundError:
+            pass
+        self._head_failure = None
+
+    def _count_pending(self):
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                return sum(1 for line in f if line.endswith(b"\n"))
+        except FileNotFoundError:
+            return 0
+
+    # Producer side
+    def append(self, user_input, agent_output, feedback, agent_id, step_number):
+        record = {
+            "id": uuid.uuid4().hex,
+            "spooled_at": datetime.now().isoformat(),
+            "step_number": step_number,
+            "agent_id": agent_id,
+            "user_input": user_input,
+            "agent_output": agent_output,
+            "feedback": feedback,
+        }
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending += 1
+            pending = self._pending
+        # While delivery is failing, wait for the next interval instead
+        if pending >= self.batch_size and self._head_failure is None:
+            self._wake.set()
+        return record["id"]
+
+    # Consumer side
+    def _read_batch(self):
+        """Return [(record, end_offset)] for up to batch_size pending records."""
+        batch = []
+        with self._lock:
+            try:
+                with open(self.path, "rb") as f:
+                    f.seek(self._offset)
+                    while len(batch) < self.batch_size:
+                        line = f.readline()
+                        # Ignore a torn trailing write until it is completed
+                        if not line or not line.endswith(b"\n"):
+                            break
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            record = None
+                        batch.append((record, f.tell()))
+            except FileNotFoundError:
+                pass
+        return batch
+
+    def _send(self, record):
+        """Deliver one record; returns SENT, REJECTED (permanent 4xx) or FAILED."""
+        for attempt in range(self.max_retries):
+            try:
+                send_feedback(
+                    record["user_input"],
+                    record["agent_output"],
+                    record["feedback"],
+                    record["agent_id"],
+                    raise_errors=True,
+                )
+                return SENT
+            except requests.exceptions.HTTPError as e:
+                self.last_error = str(e)
+                status = e.response.status_code if e.response is not None else None
+                if status is not None and 400 <= status < 500 and status not in RETRYABLE_STATUS_CODES:
+                    return REJECTED
+            except Exception as e:
+                self.last_error = str(e)
+            self.failed_attempts += 1
+            if attempt < self.max_retries - 1:
+                time.sleep(0.5 * 2**attempt)
+        return FAILED
+
+    def _record_head_failure(self, offset):
+        """Persist another failed pass on the record at offset; True once it is past the limit."""
+        state = self._head_failure
+        if state is None or state["offset"] != offset:
+            state = {"offset": offset, "first_failed_at": time.time(), "attempts": 0}
+        state = dict(state, attempts=state["attempts"] + self.max_retries)
+        self._write_head_failure(state)
+        return time.time() - state["first_failed_at"] >= self.dead_letter_after
+
+    def _dead_letter(self, record, reason):
+        record = dict(record, dead_letter_reason=reason, dead_lettered_at=datetime.now().isoformat())
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with open(self.dead_letter_path, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.dead_letter_count += 1
+
+    def _commit(self, offset, acked):
+        with self._lock:
+            self._pending -= acked
+            # Compact once everything written so far has been delivered
+            if os.path.exists(self.path) and offset >= os.path.getsize(self.path):
+                # Reset the offset before truncating: a crash in between only
+                # re-sends delivered records instead of skipping new ones
+                self._write_offset(0)
+                with open(self.path, "wb") as f:
+                    f.flush()
+                    os.fsync(f.fileno())
+            else:
+                self._write_offset(offset)
+
+    def flush(self):
+        """Send pending records in order until the spool is drained or a send fails."""
+        with self._flush_lock:
+            sent = 0
+            while True:
+                batch = self._read_batch()
+                if not batch:
+                    break
+                committed_offset = None
+                acked = 0
+                blocked = False
+                for record, end_offset in batch:
+                    start_offset = self._offset if committed_offset is None else committed_offset
+                    if record is None:
+                        self.skipped_count += 1
+                    else:
+                        outcome = self._send(record)
+                        if outcome == SENT:
+                            self.sent_count += 1
+                            sent += 1
+                        elif outcome == REJECTED:
+                            self._dead_letter(record, self.last_error)
+                        elif self._record_head_failure(start_offset):
+                            self._dead_letter(
+                                record, f"undelivered for {self.dead_letter_after:g} s: {self.last_error}"
+                            )
+                        else:
+                            blocked = True
+                            break
+                        self._clear_head_failure()
+                    committed_offset = end_offset
+                    acked += 1
+                if committed_offset is not None:
+                    self._commit(committed_offset, acked)
+                if blocked:
+                    break
+            self.last_flush_at = datetime.now().isoformat()
+            return sent
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Feedback flush failed: {e}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="feedback-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def metrics(self):
+        try:
+            spool_bytes = os.path.getsize(self.path)
+        except FileNotFoundError:
+            spool_bytes = 0
+        return {
+            "spool_path": self.path,
+            "spool_size": self._pending,
+            "spool_bytes": spool_bytes,
+            "flush_interval_seconds": self.flush_interval,
+            "batch_size": self.batch_size,
+            "max_retries": self.max_retries,
+            "sent": self.sent_count,
+            "failed_attempts": self.failed_attempts,
+            "skipped_corrupt": self.skipped_count,
+            "dead_lettered": self.dead_letter_count,
+            "dead_letter_path": self.dead_letter_path,
+            "dead_letter_after_seconds": self.dead_letter_after,
+            "head_failing_since": (
+                datetime.fromtimestamp(self._head_failure["first_failed_at"]).isoformat()
+                if self._head_failure else None
+            ),
+            "head_attempts": self._head_failure["attempts"] if self._head_failure else 0,
+            "last_flush_at": self.last_flush_at,
+            "last_error": self.last_error,
+            "flusher_running": bool(self._thread and self._thread.is_alive()),
+        }
+
+
+feedback_spool = FeedbackSpool(
+    settings.FEEDBACK_SPOOL_PATH,
+    settings.FEEDBACK_FLUSH_INTERVAL,
+    settings.FEEDBACK_BATCH_SIZE,
+    settings.FEEDBACK_MAX_RETRIES,
+    settings.FEEDBACK_DEAD_LETTER_HOURS * 3600,
+)
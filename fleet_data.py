@@ -0,0 +1,83 @@
+import re
+import threading
+
+import pandas as pd
+
+from settings import settings
+
+_number_pattern = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def parse_number(value):
+    """Leading number of a telemetry reading such as "21.5 %" or "117.46 v"."""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _number_pattern.search(str(value))
+    return float(match.group()) if match else None
+
+
+# Frames for the configured data, loaded once and shared by every in-memory view
+_shared_frames = {}
+_shared_lock = threading.Lock()
+
+
+def _store_table(table_name, source_path):
+    # Imported lazily: fleet_store itself uses the CSV loaders below for ingestion
+    from fleet_store import FleetStore
+
+    if not FleetStore.exists():
+        return None
+    store = FleetStore()
+    if not store.is_current(table_name, source_path):
+        print(
+            f"Fleet store {table_name} table is older than {source_path}; reading the CSV "
+            f"(run `python fleet_store.py ingest` to refresh the store)"
+        )
+        return None
+    return store.scan(table_name).to_pandas()
+
+
+def _shared(table_name, source_path, read_csv):
+    with _shared_lock:
+        if table_name not in _shared_frames:
+            frame = _store_table(table_name, source_path)
+            _shared_frames[table_name] = read_csv(source_path) if frame is None else frame
+        return _shared_frames[table_name]
+
+
+def _read_telemetry_csv(path):
+    telemetry = pd.read_csv(path, dtype={"VinNumber": str})
+    telemetry["LastSynchDateTime"] = pd.to_datetime(
+        telemetry["LastSynchDateTime"], format="%d-%b-%Y", errors="coerce"
+    )
+    return telemetry
+
+
+def _read_tickets_csv(path):
+    tickets = pd.read_csv(path, dtype={"VinNumber": str, "CallId": str})
+    tickets["CallPlaced"] = pd.to_datetime(tickets["CallPlaced"], format="%d-%m-%Y", errors="coerce")
+    return tickets
+
+
+def load_telemetry(path=None, use_store=True):
+    """Telemetry snapshot, one row per VIN.
+
+    The configured snapshot is read once per process, from the columnar
+    fleet store when it is up to date with the CSV, else from the CSV, and
+    the same frame is returned to every caller: treat it as read-only.
+    """
+    if path is None and use_store:
+        return _shared("telemetry", settings.TELEMETRY_DATA_PATH, _read_telemetry_csv)
+    return _read_telemetry_csv(path or settings.TELEMETRY_DATA_PATH)
+
+
+def load_tickets(path=None, use_store=True):
+    """Ticket history, one row per call, with CallPlaced parsed as a date.
+
+    Shared and read-once like load_telemetry.
+    """
+    if path is None and use_store:
+        return _shared("tickets", settings.TICKET_DATA_PATH, _read_tickets_csv)
+    return _read_tickets_csv(path or settings.TICKET_DATA_PATH)
@@ -0,0 +1,323 @@
+import argparse
+import bisect
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from settings import settings
+
+TABLES = ("telemetry", "tickets")
+# Rows per Parquet row group; VIN-sorted groups let min/max statistics prune reads
+ROWS_PER_GROUP = 65536
+
+
+def vin_bucket(vin, buckets):
+    return zlib.crc32(str(vin).encode("utf-8")) % buckets
+
+
+def _bucket_file(store_path, table, bucket):
+    return os.path.join(store_path, "ipc", table, f"bucket={bucket:03d}.arrow")
+
+
+def ingest(store_path=None, telemetry_path=None, tickets_path=None, buckets=None):
+    """Convert the fleet CSVs into VIN-sorted, VIN-bucketed Parquet and Arrow IPC files.
+
+    Layout under store_path:
+      parquet/<table>/vin_bucket=<n>/*.parquet  compressed, for scans and refreshes
+      ipc/<table>/bucket=<n>.arrow             uncompressed, memory-mapped for lookups
+      SOURCES                                  path and mtime of each source CSV
+    The store is built in a sibling directory and swapped in, so readers of
+    the previous refresh are never exposed to a half-written store.
+    """
+    from fleet_data import load_telemetry, load_tickets
+
+    store_path = store_path or settings.FLEET_STORE_PATH
+    buckets = buckets or settings.FLEET_STORE_BUCKETS
+    sources = {
+        "telemetry": os.path.abspath(telemetry_path or settings.TELEMETRY_DATA_PATH),
+        "tickets": os.path.abspath(tickets_path or settings.TICKET_DATA_PATH),
+    }
+    # Taken before reading, so a CSV edited during ingest counts as newer
+    source_mtimes = {table_name: os.path.getmtime(path) for table_name, path in sources.items()}
+    frames = {
+        "telemetry": load_telemetry(telemetry_path, use_store=False),
+        "tickets": load_tickets(tickets_path, use_store=False),
+    }
+
+    parent = os.path.dirname(os.path.abspath(store_path))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".fleet_store-", dir=parent)
+    try:
+        for table_name, frame in frames.items():
+            frame = frame.copy()
+            frame["vin_bucket"] = [vin_bucket(vin, buckets) for vin in frame["VinNumber"]]
+            frame = frame.sort_values(["vin_bucket", "VinNumber"], kind="stable")
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+
+            ds.write_dataset(
+                table,
+                os.path.join(staging, "parquet", table_name),
+                format="parquet",
+                partitioning=ds.partitioning(pa.schema([("vin_bucket", pa.int32())]), flavor="hive"),
+                max_rows_per_group=ROWS_PER_GROUP,
+                existing_data_behavior="overwrite_or_ignore",
+            )
+
+            os.makedirs(os.path.join(staging, "ipc", table_name))
+            bucket_column = frame["vin_bucket"].to_numpy()
+            data = table.drop_columns(["vin_bucket"])
+            for bucket in range(buckets):
+                rows = (bucket_column == bucket).nonzero()[0]
+                part = data.slice(rows[0], len(rows)) if len(rows) else data.slice(0, 0)
+                with pa.OSFile(_bucket_file(staging, table_name, bucket), "wb") as sink:
+                    with pa.ipc.new_file(sink, part.schema) as writer:
+                        writer.write_table(part, max_chunksize=ROWS_PER_GROUP)
+
+        with open(os.path.join(staging, "SOURCES"), "w", encoding="utf-8") as f:
+            json.dump(
+                {name: {"path": path, "mtime": source_mtimes[name]} for name, path in sources.items()}, f
+            )
+        # Written last: its presence marks a complete store
+        with open(os.path.join(staging, "BUCKETS"), "w", encoding="utf-8") as f:
+            f.write(str(buckets))
+
+        previous = None
+        if os.path.exists(store_path):
+            previous = store_path + ".previous"
+            shutil.rmtree(previous, ignore_errors=True)
+            os.replace(store_path, previous)
+        os.replace(staging, store_path)
+        if previous:
+            shutil.rmtree(previous, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return store_path
+
+
+class _SortedColumn:
+    """Sequence view over a sorted Arrow column so bisect can search it in place."""
+
+    def __init__(self, column):
+        self.column = column
+
+    def __len__(self):
+        return len(self.column)
+
+    def __getitem__(self, index):
+        return self.column[index].as_py()
+
+
+class FleetStore:
+    """Read side of the columnar fleet store.
+
+    VIN lookups memory-map a single bucket's Arrow IPC file and binary-search
+    its sorted VIN column, so neither the full table nor even the full bucket
+    is materialised. Scans go through Parquet with predicate pushdown.
+    """
+
+    def __init__(self, store_path=None):
+        self.store_path = store_path or settings.FLEET_STORE_PATH
+        with open(os.path.join(self.store_path, "BUCKETS"), "r", encoding="utf-8") as f:
+            self.buckets = int(f.read().strip())
+        self._mapped = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def exists(store_path=None):
+        return os.path.exists(os.path.join(store_path or settings.FLEET_STORE_PATH, "BUCKETS"))
+
+    def is_current(self, table_name, source_path):
+        """Whether the table was ingested from source_path and the CSV has not changed since.
+
+        A store deployed without its CSVs is always current.
+        """
+        if not os.path.exists(source_path):
+            return True
+        try:
+            with open(os.path.join(self.store_path, "SOURCES"), "r", encoding="utf-8") as f:
+                source = json.load(f).get(table_name)
+        except (FileNotFoundError, ValueError):
+            return False
+        return (
+            source is not None
+            and source["path"] == os.path.abspath(source_path)
+            and os.path.getmtime(source_path) <= source["mtime"]
+        )
+
+    def _bucket_table(self, table_name, bucket):
+        key = (table_name, bucket)
+        with self._lock:
+            if key not in self._mapped:
+                source = pa.memory_map(_bucket_file(self.store_path, table_name, bucket), "r")
+                self._mapped[key] = pa.ipc.open_file(source).read_all()
+            return self._mapped[key]
+
+    def lookup(self, table_name, vin):
+        """Rows for one VIN as an Arrow table (zero-copy slice of the mapped file)."""
+        table = self._bucket_table(table_name, vin_bucket(vin, self.buckets))
+        column = _SortedColumn(table.column("VinNumber"))
+        start = bisect.bisect_left(column, vin)
+        end = bisect.bisect_right(column, vin, lo=start)
+        return table.slice(start, end - start)
+
+    def telemetry_for(self, vin):
+        return self.lookup("telemetry", vin).to_pandas()
+
+    def tickets_for(self, vin):
+        return self.lookup("tickets", vin).to_pandas()
+
+    def scan(self, table_name, vin=None, columns=None):
+        """Parquet scan; with a VIN only its partition and matching row groups are read."""
+        dataset = ds.dataset(
+            os.path.join(self.store_path, "parquet", table_name),
+            format="parquet",
+            partitioning="hive",
+        )
+        expression = None
+        if vin is not None:
+            expression = (ds.field("vin_bucket") == vin_bucket(vin, self.buckets)) & (
+                ds.field("VinNumber") == vin
+            )
+        table = dataset.to_table(columns=columns, filter=expression)
+        if "vin_bucket" in table.column_names:
+            table = table.drop_columns(["vin_bucket"])
+        return table
+
+
+# Benchmark against CSV parsing
+
+def _rss_mb():
+    """(anonymous, file-backed) resident memory in MB.
+
+    Memory-mapped store pages show up as file-backed RSS: they are shared
+    page cache the kernel can drop, unlike the heap a parsed CSV occupies.
+    """
+    rss = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(("RssAnon:", "RssFile:")):
+                    name, value = line.split()[:2]
+                    rss[name] = int(value) / 1024
+    except OSError:
+        pass
+    if not rss:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 0.0
+    return rss.get("RssAnon:", 0.0), rss.get("RssFile:", 0.0)
+
+
+def _synthesise(csv_path, rows, output_path):
+    """Replicate a POC CSV to `rows` rows with distinct synthetic VINs."""
+    import pandas as pd
+
+    frame = pd.read_csv(csv_path, dtype=str)
+    repeats = -(-rows // len(frame))
+    frame = pd.concat([frame] * repeats, ignore_index=True).iloc[:rows]
+    frame["VinNumber"] = [f"MAR3DXS4E{index:08d}" for index in range(rows)]
+    frame.to_csv(output_path, index=False)
+    return frame["VinNumber"].sample(n=min(200, rows), random_state=0).tolist()
+
+
+def _measure(mode, path, vins):
+    anon_before, file_before = _rss_mb()
+    start = time.perf_counter()
+    if mode == "csv":
+        import pandas as pd
+
+        frame = pd.read_csv(path, dtype={"VinNumber": str})
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for vin in vins:
+            frame[frame["VinNumber"] == vin]
+    elif mode == "scan":
+        # What the app does at startup: one full read, shared by every in-memory view
+        frame = FleetStore(path).scan("telemetry").to_pandas()
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for vin in vins:
+            frame[frame["VinNumber"] == vin]
+    else:
+        store = FleetStore(path)
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for vin in vins:
+            store.telemetry_for(vin)
+    lookup_ms = 1000 * (time.perf_counter() - start) / len(vins)
+    anon_after, file_after = _rss_mb()
+    print(f"{load_seconds:.4f} {lookup_ms:.4f} {anon_after - anon_before:.1f} {file_after - file_before:.1f}")
+
+
+def benchmark(rows):
+    workdir = tempfile.mkdtemp(prefix="fleet-bench-")
+    try:
+        telemetry_csv = os.path.join(workdir, "telemetry.csv")
+        tickets_csv = os.path.join(workdir, "tickets.csv")
+        vins = _synthesise(settings.TELEMETRY_DATA_PATH, rows, telemetry_csv)
+        _synthesise(settings.TICKET_DATA_PATH, rows, tickets_csv)
+
+        start = time.perf_counter()
+        store_path = ingest(os.path.join(workdir, "store"), telemetry_csv, tickets_csv)
+        ingest_seconds = time.perf_counter() - start
+
+        print(f"Fleet store benchmark: {rows} telemetry rows, {len(vins)} VIN lookups")
+        print(f"  ingest: {ingest_seconds:.2f} s")
+        # Each side runs in a fresh interpreter so RSS is not shared between them
+        for mode, path in (("csv", telemetry_csv), ("scan", store_path), ("store", store_path)):
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_measure", mode, path, ",".join(vins)],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            load_seconds, lookup_ms, anon_mb, file_mb = result.stdout.split()[-4:]
+            print(
+                f"  {mode:>5}: load {float(load_seconds):.4f} s, "
+                f"lookup {float(lookup_ms):.4f} ms/VIN, "
+                f"RSS +{float(anon_mb):.1f} MB anonymous / +{float(file_mb):.1f} MB file-backed"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar fleet data store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser("ingest", help="convert the fleet CSVs into the store")
+    ingest_parser.add_argument("--output", default=settings.FLEET_STORE_PATH)
+    ingest_parser.add_argument("--telemetry", default=settings.TELEMETRY_DATA_PATH)
+    ingest_parser.add_argument("--tickets", default=settings.TICKET_DATA_PATH)
+    ingest_parser.add_argument("--buckets", type=int, default=settings.FLEET_STORE_BUCKETS)
+
+    benchmark_parser = commands.add_parser("benchmark", help="compare against CSV parsing")
+    benchmark_parser.add_argument("--rows", type=int, default=1_000_000)
+
+    measure_parser = commands.add_parser("_measure")
+    measure_parser.add_argument("mode", choices=("csv", "scan", "store"))
+    measure_parser.add_argument("path")
+    measure_parser.add_argument("vins")
+
+    args = parser.parse_args()
+    if args.command == "ingest":
+        path = ingest(args.output, args.telemetry, args.tickets, args.buckets)
+        print(f"Fleet store written to {path}")
+    elif args.command == "benchmark":
+        benchmark(args.rows)
+    else:
+        _measure(args.mode, args.path, args.vins.split(","))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from corrosion_detection import detect_corrosion
+from ocr_extraction import extract_text
+from settings import settings
+
+# "Atmospheric Corrosion Level: 58.58%" as read back from a detection overlay
+_metric_pattern = re.compile(r"([A-Za-z][A-Za-z ]*?)\s*[:=-]?\s*(\d+(?:\.\d+)?)\s*%")
+
+
+def batch_upload_path(base_path, index):
+    """Where the index-th image of a multi-image upload is stored."""
+    if index == 0:
+        return base_path
+    root, extension = os.path.splitext(base_path)
+    return f"{root}_{index}{extension}"
+
+
+def upload_paths(base_path):
+    """All images of the current upload for a step, in upload order."""
+    paths = []
+    while os.path.exists(batch_upload_path(base_path, len(paths))):
+        paths.append(batch_upload_path(base_path, len(paths)))
+    return paths
+
+
+def remove_stale_uploads(base_path, count):
+    """Delete images left over from an earlier, larger upload."""
+    index = count
+    while os.path.exists(batch_upload_path(base_path, index)):
+        os.remove(batch_upload_path(base_path, index))
+        index += 1
+
+
+def run_parallel(function, items, max_workers=None):
+    """Apply function to every item on a bounded pool, keeping input order."""
+    items = list(items)
+    if len(items) <= 1:
+        return [function(item) for item in items]
+    max_workers = min(max_workers or settings.IMAGE_BATCH_CONCURRENCY, len(items))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-batch") as executor:
+        return list(executor.map(function, items))
+
+
+def detection_output_path(index):
+    # The first image keeps the path the single-image flow always used
+    return "detected_corrosion.png" if index == 0 else f"detected_corrosion_{index}.png"
+
+
+def detect_and_read(indexed_path):
+    """Detect corrosion on one image, then OCR the metrics off the overlay."""
+    index, image_path = indexed_path
+    detected_path = detect_corrosion(image_path, detection_output_path(index))
+    if not detected_path:
+        return None, None
+    return detected_path, extract_text(detected_path)
+
+
+def parse_corrosion_metrics(text):
+    """{metric name: percent} read from one image's detection text."""
+    metrics = {}
+    for name, value in _metric_pattern.findall(text or ""):
+        name = " ".join(name.split()).title()
+        if name:
+            metrics[name] = float(value)
+    return metrics
+
+
+def merge_corrosion_findings(texts):
+    """One corrosion summary for the agent: worst and mean value per metric plus per-image text."""
+    if len(texts) == 1:
+        return texts[0]
+    per_image = [parse_corrosion_metrics(text) for text in texts]
+    lines = []
+    names = sorted({name for metrics in per_image for name in metrics})
+    if names:
+        lines.append(f"Aggregate over {len(texts)} images:")
+        for name in names:
+            values = [(metrics[name], index) for index, metrics in enumerate(per_image, 1) if name in metrics]
+            worst, worst_index = max(values)
+            mean = sum(value for value, _ in values) / len(values)
+            lines.append(
+                f"- {name}: max {worst:.2f}% (image {worst_index}), "
+                f"mean {mean:.2f}% over {len(values)} images"
+            )
+    for index, text in enumerate(texts, 1):
+        lines.append(f"Image {index}: {text if text else 'no corrosion metrics detected'}")
+    return "\n".join(lines)
+
+
+def merge_notes(texts):
+    """Concatenate per-image OCR text, labelled so the agent can tell pages apart."""
+    if len(texts) == 1:
+        return texts[0]
+    return "\n".join(
+        f"Page {index}: {text if text else '(no text extracted)'}" for index, text in enumerate(texts, 1)
+    )
@@ -0,0 +1,145 @@
+import io
+import mimetypes
+import os
+import threading
+import time
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from settings import settings
+
+# Running totals of what preprocessing saved, reported alongside each upload
+_stats_lock = threading.Lock()
+_stats = {
+    "images": 0,
+    "original_bytes": 0,
+    "uploaded_bytes": 0,
+    "preprocess_seconds": 0.0,
+}
+
+
+def guess_content_type(file_path, image_format=None):
+    """Return the MIME type for an image, preferring the decoded format over the extension."""
+    if image_format:
+        content_type = Image.MIME.get(image_format.upper())
+        if content_type:
+            return content_type
+    content_type, _ = mimetypes.guess_type(file_path)
+    return content_type or "application/octet-stream"
+
+
+def _record(original_bytes, uploaded_bytes, seconds):
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["original_bytes"] += original_bytes
+        _stats["uploaded_bytes"] += uploaded_bytes
+        _stats["preprocess_seconds"] += seconds
+
+
+def preprocessing_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["bytes_saved"] = stats["original_bytes"] - stats["uploaded_bytes"]
+    return stats
+
+
+def prepare_image(
+    file_path,
+    max_dimension=None,
+    quality=None,
+    grayscale=False,
+):
+    """Downscale and recompress an image for upload.
+
+    Returns (filename, payload_bytes, content_type, info). The original bytes
+    are sent untouched when preprocessing is disabled, the file cannot be
+    decoded, or recompression would not make it smaller.
+    """
+    max_dimension = max_dimension or settings.IMAGE_MAX_DIMENSION
+    quality = quality or settings.IMAGE_JPEG_QUALITY
+    filename = os.path.basename(file_path)
+
+    start = time.perf_counter()
+    with open(file_path, "rb") as f:
+        original = f.read()
+
+    payload = original
+    content_type = guess_content_type(file_path)
+    if settings.IMAGE_PREPROCESSING_ENABLED:
+        try:
+            with Image.open(io.BytesIO(original)) as image:
+                source_format = image.format
+                content_type = guess_content_type(file_path, source_format)
+
+                # Respect camera orientation before resizing
+                processed = ImageOps.exif_transpose(image)
+                if grayscale:
+                    processed = processed.convert("L")
+                elif processed.mode not in ("RGB", "L"):
+                    processed = processed.convert("RGB")
+                if max(processed.size) > max_dimension:
+                    processed.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+                buffer = io.BytesIO()
+                if source_format == "PNG":
+                    # Keep lossless output for rendered images (e.g. detection overlays)
+                    processed.save(buffer, format="PNG", optimize=True)
+                    candidate_type = "image/png"
+                else:
+                    processed.save(buffer, format="JPEG", quality=quality, optimize=True)
+                    candidate_type = "image/jpeg"
+
+            if buffer.tell() < len(original):
+                payload = buffer.getvalue()
+                content_type = candidate_type
+                filename = os.path.splitext(filename)[0] + (
+                    ".png" if candidate_type == "image/png" else ".jpg"
+                )
+        except (UnidentifiedImageError, OSError) as e:
+            print(f"Image preprocessing skipped for '{file_path}': {e}")
+
+    seconds = time.perf_counter() - start
+    _record(len(original), len(payload), seconds)
+    info = {
+        "original_bytes": len(original),
+        "uploaded_bytes": len(payload),
+        "bytes_saved": len(original) - len(payload),
+        "preprocess_seconds": seconds,
+    }
+    if info["bytes_saved"]:
+        print(
+            f"Preprocessed '{file_path}': {info['original_bytes']} -> "
+            f"{info['uploaded_bytes']} bytes ({info['bytes_saved']} saved)"
+        )
+    return filename, payload, content_type, info
+
+
+if __name__ == "__main__":
+    # Benchmark: python image_preprocessing.py [image ...]
+    # Reports upload size for every benchmark image, and OCR latency with and
+    # without preprocessing when OCR_ENDPOINT is configured.
+    import glob
+    import sys
+
+    from ocr_extraction import extract_text
+
+    paths = sys.argv[1:] or sorted(glob.glob("data/*.jpg")) + ["detected_corrosion.png"]
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for label, grayscale in (("color", False), ("grayscale", True)):
+            _, payload, content_type, info = prepare_image(path, grayscale=grayscale)
+            reduction = 100 * info["bytes_saved"] / info["original_bytes"]
+            print(
+                f"{path} [{label}]: {info['original_bytes']} -> {info['uploaded_bytes']} bytes "
+                f"({reduction:.1f}% smaller, {content_type}, "
+                f"{info['preprocess_seconds'] * 1000:.1f} ms)"
+            )
+
+        if settings.OCR_ENDPOINT:
+            for enabled in (False, True):
+                settings.IMAGE_PREPROCESSING_ENABLED = enabled
+                start = time.perf_counter()
+                extract_text(path)
+                label = "preprocessed" if enabled else "raw"
+                print(f"{path} OCR latency ({label}): {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,237 @@
+import json
+import threading
+import time
+
+import networkx as nx
+import pandas as pd
+
+from fleet_data import load_telemetry, load_tickets
+from settings import settings
+from text_utils import tokenize
+
+# Maximum number of symptoms reported for one issue description
+MAX_MATCHED_SYMPTOMS = 3
+
+
+def _node(kind, key):
+    return f"{kind}:{key}"
+
+
+class KnowledgeGraph:
+    """In-memory graph of machines, tickets and a symptom -> component -> fix catalogue.
+
+    Resolution paths per symptom and an inverted index from issue keywords to
+    symptom nodes are precomputed, so a lookup is a few dictionary reads
+    rather than an agent round-trip. Tickets and telemetry can be added
+    incrementally as they arrive.
+    """
+
+    def __init__(self):
+        self.graph = nx.DiGraph()
+        self._lock = threading.RLock()
+        # keyword token -> {(symptom node, phrase tokens)}
+        self._keyword_index = {}
+        # symptom node -> [(component node, [fix nodes])]
+        self._resolution_paths = {}
+        self.build_seconds = 0.0
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+
+    # Building
+    def load_catalogue(self, catalogue):
+        with self._lock:
+            for fix in catalogue.get("fixes", []):
+                self.graph.add_node(_node("fix", fix["id"]), kind="fix", name=fix["name"])
+            for component in catalogue.get("components", []):
+                component_node = _node("component", component["id"])
+                self.graph.add_node(
+                    component_node,
+                    kind="component",
+                    name=component["name"],
+                    telemetry=component.get("telemetry", []),
+                )
+                for fix_id in component.get("fixes", []):
+                    self.graph.add_edge(component_node, _node("fix", fix_id), relation="resolved_by")
+            for symptom in catalogue.get("symptoms", []):
+                symptom_node = _node("symptom", symptom["id"])
+                self.graph.add_node(symptom_node, kind="symptom", name=symptom["name"])
+                for component_id in symptom.get("components", []):
+                    self.graph.add_edge(symptom_node, _node("component", component_id), relation="affects")
+                for keyword in symptom.get("keywords", []):
+                    phrase = tuple(tokenize(keyword))
+                    for token in phrase:
+                        self._keyword_index.setdefault(token, set()).add((symptom_node, phrase))
+            self._precompute_paths()
+
+    def _precompute_paths(self):
+        self._resolution_paths = {}
+        for node, data in self.graph.nodes(data=True):
+            if data.get("kind") != "symptom":
+                continue
+            self._resolution_paths[node] = [
+                (component, list(self.graph.successors(component)))
+                for component in self.graph.successors(node)
+            ]
+
+    def add_telemetry(self, record):
+        """Add or update one machine's telemetry snapshot."""
+        vin = str(record["VinNumber"])
+        with self._lock:
+            machine_node = _node("machine", vin)
+            self.graph.add_node(machine_node, kind="machine", vin=vin, telemetry=dict(record))
+            alert_status = record.get("AlertStatus")
+            if pd.notna(alert_status):
+                for previous in [n for n in self.graph.successors(machine_node) if n.startswith("alert:")]:
+                    self.graph.remove_edge(machine_node, previous)
+                self._link(machine_node, "alert", alert_status, "alert_status")
+
+    def _link(self, source, kind, value, relation):
+        target = _node(kind, value)
+        if target not in self.graph:
+            self.graph.add_node(target, kind=kind, name=value)
+        self.graph.add_edge(source, target, relation=relation)
+
+    def add_ticket(self, record):
+        """Link a new ticket to its machine, call type and priority."""
+        vin = str(record["VinNumber"])
+        record = dict(record)
+        if isinstance(record.get("CallPlaced"), str):
+            record["CallPlaced"] = pd.to_datetime(record["CallPlaced"], format="%d-%m-%Y", errors="coerce")
+        with self._lock:
+            machine_node = _node("machine", vin)
+            if machine_node not in self.graph:
+                self.graph.add_node(machine_node, kind="machine", vin=vin, telemetry={})
+            ticket_count = self.graph.nodes[machine_node].get("ticket_count", 0)
+            # CallId is not unique in the source data, so qualify it per machine
+            ticket_node = _node("ticket", f"{vin}:{record.get('CallId')}:{ticket_count}")
+            self.graph.add_node(ticket_node, kind="ticket", **record)
+            self.graph.nodes[machine_node]["ticket_count"] = ticket_count + 1
+            self.graph.add_edge(machine_node, ticket_node, relation="has_ticket")
+            if pd.notna(record.get("CallType")):
+                self._link(ticket_node, "call_type", record["CallType"], "call_type")
+            if pd.notna(record.get("Priority")):
+                self._link(ticket_node, "priority", record["Priority"], "priority")
+
+    def load_fleet(self, telemetry, tickets):
+        for record in telemetry.to_dict("records"):
+            self.add_telemetry(record)
+        for record in tickets.to_dict("records"):
+            self.add_ticket(record)
+
+    # Querying
+    def match_symptoms(self, issue_description):
+        """Rank catalogue symptoms whose keyword phrases all appear in the issue text."""
+        tokens = set(tokenize(issue_description))
+        scores = {}
+        with self._lock:
+            candidates = set()
+            for token in tokens:
+                candidates.update(self._keyword_index.get(token, ()))
+            for symptom_node, phrase in candidates:
+                if not set(phrase) <= tokens:
+                    continue
+                # Longer phrases and keywords shared by fewer symptoms are more specific
+                specificity = sum(
+                    1 / len({s for s, _ in self._keyword_index[token]}) for token in phrase
+                )
+                scores[symptom_node] = scores.get(symptom_node, 0.0) + specificity
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:MAX_MATCHED_SYMPTOMS]
+
+    def _machine_context(self, vin):
+        machine_node = _node("machine", vin)
+        if machine_node not in self.graph:
+            return [f"No fleet records found for VIN {vin}."]
+
+        telemetry = self.graph.nodes[machine_node].get("telemetry", {})
+        lines = []
+        if telemetry:
+            lines.append(
+                f"Machine {vin}: AlertStatus {telemetry.get('AlertStatus')}, "
+                f"EngineStatus {telemetry.get('EngineStatus')}, "
+                f"HealthAlerts {telemetry.get('HealthAlertCounts')}, "
+                f"ServiceAlerts {telemetry.get('ServiceAlertCounts')}"
+            )
+
+        tickets = [
+            self.graph.nodes[n] for n in self.graph.successors(machine_node) if n.startswith("ticket:")
+        ]
+        if tickets:
+            call_types = {}
+            for ticket in tickets:
+                call_types[ticket.get("CallType")] = call_types.get(ticket.get("CallType"), 0) + 1
+            summary = ", ".join(f"{count} {call_type}" for call_type, count in sorted(call_types.items()))
+            latest = max(
+                tickets,
+                key=lambda t: t["CallPlaced"] if pd.notna(t.get("CallPlaced")) else pd.Timestamp.min,
+            )
+            placed = latest.get("CallPlaced")
+            placed = placed.strftime("%d-%m-%Y") if hasattr(placed, "strftime") else placed
+            lines.append(
+                f"Ticket history: {len(tickets)} tickets ({summary}); "
+                f"latest {latest.get('CallType')} on {placed} ({latest.get('Priority')})"
+            )
+        else:
+            lines.append("Ticket history: no tickets on record")
+        return lines
+
+    def analyse(self, vin, issue_description):
+        """Plain-text resolution paths for the troubleshooting prompt."""
+        start = time.perf_counter()
+        with self._lock:
+            matches = self.match_symptoms(issue_description)
+            lines = self._machine_context(vin)
+            telemetry = self.graph.nodes.get(_node("machine", vin), {}).get("telemetry", {})
+
+            if not matches:
+                lines.append("No catalogued symptom matches the issue description.")
+            for symptom_node, score in matches:
+                lines.append(f"Symptom: {self.graph.nodes[symptom_node]['name']} (match score {score:.2f})")
+                for component_node, fix_nodes in self._resolution_paths.get(symptom_node, []):
+                    component = self.graph.nodes[component_node]
+                    readings = [
+                        f"{field}={telemetry[field]}"
+                        for field in component.get("telemetry", [])
+                        if not pd.isna(telemetry.get(field))
+                    ]
+                    reading_text = f" [{', '.join(readings)}]" if readings else ""
+                    fixes = "; ".join(self.graph.nodes[f]["name"] for f in fix_nodes)
+                    lines.append(f"  -> {component['name']}{reading_text} -> {fixes}")
+        # Kept out of the text so identical lookups produce identical prompts
+        self.lookups += 1
+        self.lookup_seconds += time.perf_counter() - start
+        return "\n".join(lines)
+
+    def metrics(self):
+        with self._lock:
+            kinds = {}
+            for _, data in self.graph.nodes(data=True):
+                kinds[data.get("kind", "other")] = kinds.get(data.get("kind", "other"), 0) + 1
+            return {
+                "nodes": self.graph.number_of_nodes(),
+                "edges": self.graph.number_of_edges(),
+                "nodes_by_kind": kinds,
+                "keywords": len(self._keyword_index),
+                "build_seconds": self.build_seconds,
+                "lookups": self.lookups,
+                "lookup_ms_avg": 1000 * self.lookup_seconds / self.lookups if self.lookups else 0.0,
+            }
+
+
+def build_knowledge_graph():
+    start = time.perf_counter()
+    knowledge_graph = KnowledgeGraph()
+    try:
+        with open(settings.KG_CATALOGUE_PATH, "r", encoding="utf-8") as f:
+            knowledge_graph.load_catalogue(json.load(f))
+    except FileNotFoundError:
+        print(f"Knowledge graph catalogue not found: {settings.KG_CATALOGUE_PATH}")
+    try:
+        knowledge_graph.load_fleet(load_telemetry(), load_tickets())
+    except FileNotFoundError as e:
+        print(f"Knowledge graph fleet data not found: {e}")
+    knowledge_graph.build_seconds = time.perf_counter() - start
+    return knowledge_graph
+
+
+knowledge_graph = build_knowledge_graph()
@@ -0,0 +1,66 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from admission_control import speculative
+from settings import settings
+
+
+class Prefetcher:
+    """Runs speculative step computations in the background within a fixed budget.
+
+    At most `budget` prefetches are queued or running at once; anything
+    beyond that is dropped rather than delaying real requests. Agent calls
+    made by a prefetch are admitted as speculative, below routine requests.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self._executor = ThreadPoolExecutor(max_workers=budget, thread_name_prefix="prefetch")
+        self._slots = threading.BoundedSemaphore(budget)
+        self._lock = threading.Lock()
+        self.launched = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def submit(self, task, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            return None
+        with self._lock:
+            self.launched += 1
+        future = self._executor.submit(self._run, task, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    @staticmethod
+    def _run(task, *args):
+        token = speculative.set(True)
+        try:
+            return task(*args)
+        finally:
+            speculative.reset(token)
+
+    def _done(self, future):
+        self._slots.release()
+        error = future.exception()
+        if error is not None:
+            with self._lock:
+                self.failed += 1
+            print(f"Prefetch failed: {error}")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "enabled": settings.PREFETCH_ENABLED,
+                "budget": self.budget,
+                "launched": self.launched,
+                "skipped_over_budget": self.skipped,
+                "failed": self.failed,
+            }
+
+
+prefetcher = Prefetcher(settings.PREFETCH_BUDGET)
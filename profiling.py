@@ -0,0 +1,360 @@
+import asyncio
+import contextvars
+import functools
+import json
+import marshal
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from settings import settings
+
+# Deepest stack recorded per sample
+MAX_STACK_DEPTH = 128
+
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    """Wall-clock stack samples for one request (or one Streamlit rerun).
+
+    Samples are taken from every thread attached to the profile, so time
+    spent blocked on upstream I/O shows up as well as CPU time. The event
+    loop thread is only sampled while this request's task is the one
+    running on it, so concurrent requests don't leak into the profile.
+    """
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = datetime.now().isoformat()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.status_code = None
+        self._threads = {}
+        self._lock = threading.Lock()
+        # (thread label, stack of frame keys, root first) -> sample count
+        self.samples = {}
+        self.finished = False
+        # Event loop, its thread and the request's task, for async requests
+        self.loop = None
+        self.loop_thread = None
+        self.task = None
+
+    def attach(self, label=None):
+        ident = threading.get_ident()
+        with self._lock:
+            name, depth = self._threads.get(ident, (label or threading.current_thread().name, 0))
+            self._threads[ident] = (name, depth + 1)
+
+    def detach(self):
+        ident = threading.get_ident()
+        with self._lock:
+            name, depth = self._threads[ident]
+            if depth > 1:
+                self._threads[ident] = (name, depth - 1)
+            else:
+                del self._threads[ident]
+
+    def sample(self, frames):
+        with self._lock:
+            if self.finished:
+                return
+            for ident, (label, _) in self._threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                if ident == self.loop_thread and asyncio.current_task(self.loop) is not self.task:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                key = (label, tuple(reversed(stack)))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def finish(self):
+        with self._lock:
+            self.finished = True
+            self.duration = time.perf_counter() - self._start
+
+    def to_record(self, interval):
+        frames = {}
+        samples = []
+        with self._lock:
+            collected = list(self.samples.items())
+        for (label, stack), count in collected:
+            indexes = [frames.setdefault(frame, len(frames)) for frame in stack]
+            samples.append([label, indexes, count])
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(1000 * (self.duration or 0.0), 3),
+            "status_code": self.status_code,
+            "interval_ms": 1000 * interval,
+            "sample_count": sum(count for _, count in collected),
+            "frames": [list(frame) for frame in frames],
+            "samples": samples,
+        }
+
+
+class Sampler:
+    """Background thread that samples active profiles; idle when there are none."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self._active.add(profile)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def remove(self, profile):
+        with self._lock:
+            self._active.discard(profile)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._wake.wait()
+                active = list(self._active)
+            frames = sys._current_frames()
+            frames.pop(own, None)
+            for profile in active:
+                profile.sample(frames)
+            del frames
+            time.sleep(self.interval)
+
+
+class ProfileStore:
+    """Most recent profiles as JSON files in a directory, oldest evicted first.
+
+    On disk so the API server and the Streamlit app share one store and
+    profiles survive a restart.
+    """
+
+    def __init__(self, path, max_profiles):
+        self.path = path
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def _file(self, profile_id):
+        return os.path.join(self.path, f"{profile_id}.json")
+
+    def _files(self):
+        try:
+            names = [name for name in os.listdir(self.path) if name.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        paths = []
+        for name in names:
+            path = os.path.join(self.path, name)
+            # The other process may evict a file while we list
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass
+        return [path for _, path in sorted(paths)]
+
+    def save(self, record):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_path = self._file(record["id"]) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            os.replace(tmp_path, self._file(record["id"]))
+            files = self._files()
+            for path in files[: max(0, len(files) - self.max_profiles)]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def load(self, profile_id):
+        # Profile IDs are hex; anything else cannot name a stored file
+        if not profile_id.isalnum():
+            return None
+        try:
+            with open(self._file(profile_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def list(self):
+        summaries = []
+        for path in reversed(self._files()):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            summaries.append({key: record[key] for key in (
+                "id", "name", "started_at", "duration_ms", "status_code", "sample_count"
+            )})
+        return summaries
+
+
+sampler = Sampler(settings.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+profile_store = ProfileStore(settings.PROFILE_STORE_PATH, settings.PROFILE_MAX_STORED)
+
+if settings.PROFILING_ENABLED and not settings.PROFILING_ADMIN_TOKEN:
+    print("PROFILING_ENABLED is set without PROFILING_ADMIN_TOKEN; profiling stays off")
+
+
+# Instrumentation
+@contextmanager
+def profile_block(name, task=None):
+    """Profile the current thread (and attached workers) for the duration of the block."""
+    profile = RequestProfile(name)
+    if task is not None:
+        profile.loop = asyncio.get_running_loop()
+        profile.loop_thread = threading.get_ident()
+        profile.task = task
+    profile.attach("main" if task is None else "event-loop")
+    token = _current_profile.set(profile)
+    sampler.add(profile)
+    try:
+        yield profile
+    finally:
+        sampler.remove(profile)
+        _current_profile.reset(token)
+        profile.detach()
+        profile.finish()
+        try:
+            profile_store.save(profile.to_record(sampler.interval))
+        except OSError as e:
+            print(f"Failed to store profile {profile.id}: {e}")
+
+
+def profiled(func):
+    """Let the active request profile sample the worker thread running func."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _current_profile.get()
+        if profile is None:
+            return func(*args, **kwargs)
+        profile.attach()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.detach()
+
+    return wrapper
+
+
+def profiling_requested(header_value):
+    # The trigger must carry the admin token; without one configured nothing is profiled
+    if not settings.PROFILING_ENABLED or not settings.PROFILING_ADMIN_TOKEN or not header_value:
+        return False
+    return header_value == settings.PROFILING_ADMIN_TOKEN
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests that carry the profiling header.
+
+    Requests without it (or with profiling disabled) pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.header = settings.PROFILE_HEADER.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.PROFILING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        header_value = dict(scope["headers"]).get(self.header)
+        if not profiling_requested(header_value.decode("latin-1") if header_value else None):
+            await self.app(scope, receive, send)
+            return
+
+        name = f"{scope['method']} {scope['path']}"
+        with profile_block(name, asyncio.current_task()) as profile:
+
+            async def send_with_profile_id(message):
+                if message["type"] == "http.response.start":
+                    profile.status_code = message["status"]
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-profile-id", profile.id.encode("latin-1"))
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_profile_id)
+
+
+# Export formats
+def to_pstats(record):
+    """Marshalled pstats data built from samples (times are sampled wall-clock).
+
+    Call counts are sample counts, not real call counts.
+    """
+    interval = record["interval_ms"] / 1000
+    frames = [tuple(frame) for frame in record["frames"]]
+    stats = {}
+
+    def entry(key):
+        if key not in stats:
+            stats[key] = [0, 0, 0.0, 0.0, {}]
+        return stats[key]
+
+    for _, stack, count in record["samples"]:
+        weight = count * interval
+        keys = [frames[index] for index in stack]
+        for key in set(keys):
+            row = entry(key)
+            row[0] += count
+            row[1] += count
+            row[3] += weight
+        if keys:
+            entry(keys[-1])[2] += weight
+        for caller, callee in set(zip(keys, keys[1:])):
+            callers = entry(callee)[4]
+            nc, cc, tt, ct = callers.get(caller, (0, 0, 0.0, 0.0))
+            callers[caller] = (nc + count, cc + count, tt + (weight if callee == keys[-1] else 0.0), ct + weight)
+    return marshal.dumps({key: (nc, cc, tt, ct, callers) for key, (nc, cc, tt, ct, callers) in stats.items()})
+
+
+def to_speedscope(record):
+    """speedscope.app "sampled" profile, one profile per sampled thread."""
+    interval_ms = record["interval_ms"]
+    by_thread = {}
+    for label, stack, count in record["samples"]:
+        thread = by_thread.setdefault(label, {"samples": [], "weights": []})
+        thread["samples"].append(stack)
+        thread["weights"].append(count * interval_ms)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": record["name"],
+        "exporter": "troubleshooter-profiling",
+        "shared": {
+            "frames": [{"name": name, "file": file, "line": line} for file, line, name in record["frames"]],
+        },
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": f"{record['name']} [{label}]",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(thread["weights"]),
+                "samples": thread["samples"],
+                "weights": thread["weights"],
+            }
+            for label, thread in by_thread.items()
+        ],
+    }
@@ -0,0 +1,146 @@
+import math
+import threading
+import time
+import zlib
+from collections import deque
+
+from settings import settings
+from text_utils import tokenize
+
+# Size of the hashed feature space for term vectors
+VECTOR_DIMENSIONS = 2**18
+# Number of recent lookups kept for latency metrics
+MAX_LATENCY_SAMPLES = 1000
+
+
+def term_frequencies(text):
+    """Sub-linear term frequencies of hashed, stemmed word features."""
+    counts = {}
+    for token in tokenize(text):
+        index = zlib.crc32(token.encode("utf-8")) % VECTOR_DIMENSIONS
+        counts[index] = counts.get(index, 0) + 1
+    return {index: 1 + math.log(count) for index, count in counts.items()}
+
+
+def tfidf(frequencies, document_frequencies, documents):
+    """L2-normalised TF-IDF vector using smoothed inverse document frequency."""
+    vector = {
+        index: value * (math.log((1 + documents) / (1 + document_frequencies.get(index, 0))) + 1)
+        for index, value in frequencies.items()
+    }
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    if not norm:
+        return {}
+    return {index: value / norm for index, value in vector.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of agent responses, one index per (agent_id, VIN).
+
+    Only the issue description is compared, never the full prompt: the rest
+    of a prompt is machine data or upstream output, which would swamp the
+    few words that say what is wrong. Answers are only ever reused for the
+    same machine and the same agent. Document frequencies are shared
+    across all indexes, so words every issue uses weigh less than the ones
+    that tell issues apart.
+
+    Callers whose prompt embeds live data pass a context_version; an index
+    only answers lookups for the version it was filled under, so a small
+    numeric change in the data can never be matched to a stale answer.
+    """
+
+    def __init__(self, threshold, max_entries):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._indexes = {}
+        self._index_versions = {}
+        self._document_frequencies = {}
+        self._documents = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._latencies = deque(maxlen=MAX_LATENCY_SAMPLES)
+
+    def lookup(self, agent_id, vin, issue_text, context_version=None):
+        """Return a copy of the closest cached response, or None below the threshold."""
+        start = time.perf_counter()
+        frequencies = term_frequencies(issue_text)
+        best_score, best_response = 0.0, None
+        with self._lock:
+            index = self._indexes.get((agent_id, vin), ())
+            if self._index_versions.get((agent_id, vin)) != context_version:
+                index = ()
+            if index:
+                vector = tfidf(frequencies, self._document_frequencies, self._documents)
+            for entry_frequencies, response in index:
+                entry_vector = tfidf(entry_frequencies, self._document_frequencies, self._documents)
+                score = cosine(vector, entry_vector)
+                if score > best_score:
+                    best_score, best_response = score, response
+            hit = best_response is not None and best_score >= self.threshold
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._latencies.append(time.perf_counter() - start)
+
+        if not hit:
+            return None
+        reused = dict(best_response)
+        reused["cache_reuse"] = True
+        reused["similarity"] = round(best_score, 4)
+        return reused
+
+    def _count_document(self, frequencies, delta):
+        self._documents += delta
+        for index in frequencies:
+            count = self._document_frequencies.get(index, 0) + delta
+            if count > 0:
+                self._document_frequencies[index] = count
+            else:
+                self._document_frequencies.pop(index, None)
+
+    def store(self, agent_id, vin, issue_text, response, context_version=None):
+        frequencies = term_frequencies(issue_text)
+        with self._lock:
+            index = self._indexes.setdefault((agent_id, vin), deque())
+            if self._index_versions.get((agent_id, vin)) != context_version:
+                while index:
+                    self._count_document(index.popleft()[0], -1)
+                self._index_versions[(agent_id, vin)] = context_version
+            if len(index) >= self.max_entries:
+                evicted_frequencies, _ = index.popleft()
+                self._count_document(evicted_frequencies, -1)
+            index.append((frequencies, response))
+            self._count_document(frequencies, 1)
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            lookups = self.hits + self.misses
+            entries = sum(len(index) for index in self._indexes.values())
+            indexes = len(self._indexes)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+        return {
+            "enabled": settings.SEMANTIC_CACHE_ENABLED,
+            "threshold": self.threshold,
+            "indexes": indexes,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "lookup_latency_ms_avg": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+            "lookup_latency_ms_p95": 1000 * p95,
+        }
+
+
+semantic_cache = SemanticCache(
+    settings.SEMANTIC_CACHE_THRESHOLD,
+    settings.SEMANTIC_CACHE_MAX_ENTRIES,
+)
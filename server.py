@@ -1,11 +1,14 @@
+import json
 import os
-from typing import Optional, Dict, Any
-from fastapi import FastAPI, File, Form, UploadFile, HTTPException
+from typing import List, Optional
+from fastapi import FastAPI, File, Form, Header, Request, Response, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from datetime import datetime
 from settings import settings
 
+from admission_control import admission_controller
 from agent import (
     analyse_handwritten_data,
     generate_corrosion_analysis,
@@ -13,8 +16,18 @@ from agent import (
     generate_telemetry_analysis,
     generate_ticket_history_analysis,
     troubleshoot_issue,
-    send_feedback
 )
+from feedback_spool import feedback_spool
+from image_batch import batch_upload_path, remove_stale_uploads, upload_paths
+from image_preprocessing import preprocessing_stats
+from knowledge_graph import knowledge_graph
+from prefetch import prefetcher
+from profiling import ProfilingMiddleware, profile_store, profiled, to_pstats, to_speedscope
+from semantic_cache import semantic_cache
+from spatial_index import spatial_index
+from step_cache import StepCache, file_sha256, fingerprint, is_error
+from telemetry_stream import telemetry_stream
+from ticket_analytics import ticket_analytics
 
 app = FastAPI()
 
@@ -27,8 +40,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory cache to store analysis results
-analysis_cache: Dict[str, Dict[str, Any]] = {}
+# Samples requests that carry the profiling header when PROFILING_ENABLED is set
+app.add_middleware(ProfilingMiddleware)
+
+@app.on_event("startup")
+async def start_background_workers():
+    feedback_spool.start()
+    if settings.TELEMETRY_TAIL_PATH:
+        telemetry_stream.start_tail(settings.TELEMETRY_TAIL_PATH, settings.TELEMETRY_TAIL_INTERVAL)
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    feedback_spool.stop(timeout=5)
+    telemetry_stream.stop(timeout=5)
+    prefetcher.shutdown()
+
+# In-memory cache of step results, keyed by session and input fingerprint
+analysis_cache = StepCache()
+
+CORROSION_UPLOAD_PATH = "data/corrosion_upload.jpg"
+HANDWRITING_UPLOAD_PATH = "data/handwriting_upload.jpg"
+
+# Keep the knowledge graph and admission priorities on the latest streamed telemetry
+telemetry_stream.subscribe(knowledge_graph.add_telemetry)
+telemetry_stream.subscribe(spatial_index.add_telemetry)
+telemetry_stream.subscribe(
+    lambda record: admission_controller.update_priority(
+        record["VinNumber"], alert_status=record.get("AlertStatus")
+    )
+)
 
 # Models
 class FeedbackRequest(BaseModel):
@@ -43,49 +83,204 @@ class FeedbackResponse(BaseModel):
     feedbackReceived: bool
     timestamp: str
 
+class TicketRecord(BaseModel):
+    VinNumber: str
+    CallId: str
+    CallPlaced: str
+    CallType: str
+    Priority: str
+    MachineNumber: Optional[str] = None
+    CreatedBy: Optional[str] = None
+    CallAssigned: Optional[str] = None
+    SerialNumber: Optional[str] = None
+
 # Helper function to save uploaded images
 async def save_uploaded_file(file: UploadFile, path: str):
     if file:
-        with open(path, "wb") as f:
+        # Write then rename so background readers never see a half-written image
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
             f.write(await file.read())
+        os.replace(tmp_path, path)
         return path
     return None
 
+# Save a multi-image upload as path, path_1, path_2, ... replacing the previous set
+async def save_uploaded_files(files: Optional[List[UploadFile]], path: str):
+    files = [file for file in files or [] if file]
+    if not files:
+        return []
+    if len(files) > settings.IMAGE_BATCH_MAX_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.IMAGE_BATCH_MAX_IMAGES} images can be uploaded per step",
+        )
+    paths = [await save_uploaded_file(file, batch_upload_path(path, index)) for index, file in enumerate(files)]
+    remove_stale_uploads(path, len(files))
+    return paths
+
+# Cached step runners. Each returns its output and only calls the agent when
+# the fingerprint of its inputs differs from the cached one. The telemetry and
+# ticket runners return (output, similarity), where similarity is set when the
+# answer was reused from the semantic cache (None for a fresh answer).
+@profiled
+def run_telemetry_step(session_id: str, vin: str, issue_description: str):
+    step_fingerprint = fingerprint(
+        "telemetry", vin, issue_description, settings.TELEMETRY_AGENT_ID, telemetry_stream.version(vin)
+    )
+    return analysis_cache.get_or_compute(
+        session_id, "telemetry_analysis", step_fingerprint,
+        lambda: generate_telemetry_analysis(session_id, vin, issue_description),
+    )
+
+@profiled
+def run_corrosion_step(session_id: str, vin: str, issue_description: str, prefetch: bool = False):
+    nearby_context = spatial_index.nearby_context(vin, "corrosion")
+    image_paths = upload_paths(CORROSION_UPLOAD_PATH) or [CORROSION_UPLOAD_PATH]
+    step_fingerprint = fingerprint(
+        "corrosion", vin, issue_description,
+        [file_sha256(path) for path in image_paths], settings.CORROSION_AGENT_ID,
+        spatial_index.nearby_context(vin, "corrosion", findings=False),
+    )
+
+    def compute():
+        _, corrosion_analysis = generate_corrosion_analysis(
+            session_id, issue_description, image_paths, nearby_context, vin=vin
+        )
+        # Shared with nearby machines' future corrosion and troubleshooting prompts
+        if corrosion_analysis and not is_error(corrosion_analysis):
+            spatial_index.record_finding(vin, "corrosion", corrosion_analysis)
+        return corrosion_analysis
+
+    return analysis_cache.get_or_compute(
+        session_id, "corrosion_analysis", step_fingerprint, compute, prefetch=prefetch
+    )
+
+@profiled
+def run_ticket_step(session_id: str, vin: str, issue_description: str, prefetch: bool = False):
+    step_fingerprint = fingerprint(
+        "ticket", vin, issue_description, settings.TICKET_AGENT_ID, ticket_analytics.version(vin)
+    )
+    return analysis_cache.get_or_compute(
+        session_id, "ticket_analysis", step_fingerprint,
+        lambda: generate_ticket_history_analysis(session_id, issue_description, vin),
+        prefetch=prefetch,
+    )
+
+@profiled
+def run_handwritten_step(session_id: str, vin: str, issue_description: str, prefetch: bool = False):
+    image_paths = upload_paths(HANDWRITING_UPLOAD_PATH) or [HANDWRITING_UPLOAD_PATH]
+    step_fingerprint = fingerprint(
+        "handwritten", vin, issue_description,
+        [file_sha256(path) for path in image_paths], settings.OCR_AGENT_ID,
+    )
+
+    def compute():
+        _, handwritten_analysis, _ = analyse_handwritten_data(
+            session_id, issue_description, image_paths, vin=vin
+        )
+        return handwritten_analysis
+
+    return analysis_cache.get_or_compute(
+        session_id, "handwritten_analysis", step_fingerprint, compute, prefetch=prefetch
+    )
+
+@profiled
+def run_troubleshooting_step(session_id: str, vin: str, issue_description: str):
+    telemetry_analysis, _ = run_telemetry_step(session_id, vin, issue_description)
+    corrosion_analysis = run_corrosion_step(session_id, vin, issue_description)
+    ticket_analysis, _ = run_ticket_step(session_id, vin, issue_description)
+    handwritten_analysis = run_handwritten_step(session_id, vin, issue_description)
+    upstream_results = (telemetry_analysis, corrosion_analysis, ticket_analysis, handwritten_analysis)
+
+    # Resolution paths from the local knowledge graph (no agent round-trip)
+    kg_analysis_output = knowledge_graph.analyse(vin, issue_description)
+    nearby_context = spatial_index.nearby_context(vin)
+
+    # Keyed on the upstream results themselves, which is exactly what the prompt sees
+    step_fingerprint = fingerprint(
+        "troubleshooting", vin, issue_description, settings.TROUBLESHOOTING_AGENT_ID,
+        upstream_results, kg_analysis_output, spatial_index.nearby_context(vin, findings=False),
+    )
+
+    def compute():
+        return troubleshoot_issue(
+            session_id,
+            issue_description,
+            telemetry_analysis or "Telemetry data not available",
+            corrosion_analysis or "Corrosion analysis not available",
+            ticket_analysis or "Ticket history not available",
+            kg_analysis_output,
+            handwritten_analysis or "Handwritten analysis not available",
+            nearby_context,
+            vin=vin,
+        )
+
+    # Failed upstream steps are retried on the next request, so an answer
+    # built on one must not be cached either
+    if any(is_error(result) for result in upstream_results):
+        return compute()
+    return analysis_cache.get_or_compute(session_id, "troubleshooting_result", step_fingerprint, compute)
+
+@profiled
+def run_manager_step(session_id: str, vin: str, issue_description: str):
+    troubleshooting_result = run_troubleshooting_step(session_id, vin, issue_description)
+    step_fingerprint = fingerprint(
+        "manager", vin, issue_description, settings.MANAGER_AGENT_ID, troubleshooting_result
+    )
+
+    def compute():
+        return generate_manager_analysis(session_id, issue_description, troubleshooting_result, vin)
+
+    if is_error(troubleshooting_result):
+        return compute()
+    return analysis_cache.get_or_compute(session_id, "manager_analysis", step_fingerprint, compute)
+
+def prefetch_later_steps(session_id: str, vin: str, issue_description: str):
+    prefetcher.submit(run_ticket_step, session_id, vin, issue_description, True)
+    # Image steps can only be prefetched once an image has been uploaded
+    if os.path.exists(CORROSION_UPLOAD_PATH):
+        prefetcher.submit(run_corrosion_step, session_id, vin, issue_description, True)
+    if os.path.exists(HANDWRITING_UPLOAD_PATH):
+        prefetcher.submit(run_handwritten_step, session_id, vin, issue_description, True)
+
 # Step 1: Telemetry Analysis
 @app.post("/api/steps/1")
 async def telemetry_analysis(
     vinNumber: str = Form(...),
     issueDescription: str = Form(...),
-    corrosionImage: Optional[UploadFile] = File(None),
-    handwritingImage: Optional[UploadFile] = File(None)
+    corrosionImage: Optional[List[UploadFile]] = File(None),
+    handwritingImage: Optional[List[UploadFile]] = File(None)
 ):
     try:
         # Save images if uploaded
-        if corrosionImage:
-            await save_uploaded_file(corrosionImage, f"data/corrosion_upload.jpg")
-        if handwritingImage:
-            await save_uploaded_file(handwritingImage, f"data/handwriting_upload.jpg")
+        await save_uploaded_files(corrosionImage, CORROSION_UPLOAD_PATH)
+        await save_uploaded_files(handwritingImage, HANDWRITING_UPLOAD_PATH)
         
         # Use VIN number as session ID
         session_id = vinNumber
         
+        # Speculatively start steps 2-4; their requests attach to this work
+        if settings.PREFETCH_ENABLED:
+            prefetch_later_steps(session_id, vinNumber, issueDescription)
+        
         # Generate telemetry analysis
-        telemetry_analysis = generate_telemetry_analysis(session_id, vinNumber, issueDescription)
+        telemetry_analysis, similarity = await run_in_threadpool(
+            run_telemetry_step, session_id, vinNumber, issueDescription
+        )
         # telemetry_analysis = "Based on the telemetry data analysis for VIN MAR3DXS4E03123318:\n\nCRITICAL FINDINGS:\n- Engine Oil Pressure reading is at 59, which is within normal operating range, showing no immediate indication of oil clogging.\n- The machine currently shows 'Green' AlertStatus, suggesting no critical system warnings.\n- Last system synchronization occurred on 14-Mar-2024 with the engine currently in 'Off' state.\n\nHEALTH INDICATORS:\n- System has logged 6 Health Alerts and 2 Service Alerts, indicating some historical maintenance needs.\n- The combination of alerts and current oil pressure readings suggests monitoring may be required, despite current 'Green' status.\n\nNote: While the current telemetry data shows stable readings, the presence of multiple health alerts warrants attention to the engine oil system."
         
-        # Store in cache
-        if session_id not in analysis_cache:
-            analysis_cache[session_id] = {}
-        analysis_cache[session_id]['telemetry_analysis'] = telemetry_analysis
-        analysis_cache[session_id]['issue_description'] = issueDescription
-        
         return {
             "stepNumber": 1,
             "output": telemetry_analysis,
+            "cacheReuse": similarity is not None,
+            "similarity": similarity,
             "status": "success",
             "timestamp": datetime.now().isoformat(),
             "websocket_url": f"wss://metrics.studio.lyzr.ai/ws/{session_id}"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -94,36 +289,28 @@ async def telemetry_analysis(
 async def vision_inspection(
     vinNumber: str = Form(...),
     issueDescription: str = Form(...),
-    corrosionImage: Optional[UploadFile] = File(None),
-    handwritingImage: Optional[UploadFile] = File(None)
+    corrosionImage: Optional[List[UploadFile]] = File(None),
+    handwritingImage: Optional[List[UploadFile]] = File(None)
 ):
     try:
-        # Save corrosion image if uploaded
-        corrosion_path = "data/corrosion_upload.jpg"
-        if corrosionImage:
-            await save_uploaded_file(corrosionImage, corrosion_path)
+        # Save corrosion images if uploaded
+        await save_uploaded_files(corrosionImage, CORROSION_UPLOAD_PATH)
         
         # Use VIN number as session ID
         session_id = vinNumber
         
         # Generate corrosion analysis
-        final_image_path, corrosion_analysis = generate_corrosion_analysis(
-            session_id, issueDescription, corrosion_path
-        )
+        corrosion_analysis = await run_in_threadpool(run_corrosion_step, session_id, vinNumber, issueDescription)
         # corrosion_analysis = "**Corrosion Metric Assessment:**\n\n1. **Atmospheric Corrosion Level: 63.40% (Moderate Severity)**\n   - The atmospheric corrosion level indicates a moderate degree of corrosion risk. Potential causes could include prolonged exposure to moisture, chemical pollutants, or high humidity environments. This level of corrosion could be contributing to the overall degradation of protective coatings on the machine.\n\n2. **Pitting Corrosion Level: 11.79% (Low Severity)**\n   - The low severity of pitting corrosion suggests minimal localized corrosion activity. Potential causes may include intermittent exposure to aggressive materials or irregular surface conditions. While currently low, it indicates that conditions favoring pitting may be present and should be monitored.\n\n3. **Degradation Index: 23.52% (Low Severity)**\n   - The degradation index at this level indicates a relatively low overall deterioration of the machine's materials. This suggests that, while there are issues, the machine is in a stable condition overall. Potential causes could include normal wear and tear, coupled with low exposure to corrosive environments.\n\n**Analysis of Correlation Between Corrosion Types:**\nThe moderate atmospheric corrosion may be affecting the machine's condition by compromising protective coatings, leading to the development of conditions that could promote pitting corrosion in the future. However, as pitting corrosion currently presents a low severity, it is less likely to be a direct contributor to the immediate issue of clogged engine oil. The degradation index supports this view, indicating that the machine's overall structural integrity has not been significantly compromised at this stage.\n\nThe presence of atmospheric corrosion might indirectly influence oil flow through the potential disruption of machinery components, surface finishes, or seals that could allow for debris accumulation, further contributing to the clogged engine oil issue.\n\n**Overall Assessment:**\nThe machine exhibits a moderate risk of atmospheric corrosion, with minimal pitting and degradation. The clogging of engine oil might be more related to operational factors or the cleanliness of the environment rather than severe corrosion. However, attention to atmospheric corrosion levels is warranted to prevent future complications.\n\n**Priority Level for Maintenance/Intervention:**\nGiven the current corrosion metrics and the issue described, priority for intervention is moderate. While immediate severe corrosion issues are not present, regular monitoring and maintenance will be necessary to ensure atmospheric corrosion does not increase and to address any operational factors leading to the oil clogging."
         
-        # Store in cache
-        if session_id not in analysis_cache:
-            analysis_cache[session_id] = {}
-        analysis_cache[session_id]['corrosion_analysis'] = corrosion_analysis
-        analysis_cache[session_id]['issue_description'] = issueDescription
-        
         return {
             "stepNumber": 2,
             "output": corrosion_analysis,
             "status": "success",
             "timestamp": datetime.now().isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -132,26 +319,24 @@ async def vision_inspection(
 async def ticket_history(
     vinNumber: str = Form(...),
     issueDescription: str = Form(...),
-    corrosionImage: Optional[UploadFile] = File(None),
-    handwritingImage: Optional[UploadFile] = File(None)
+    corrosionImage: Optional[List[UploadFile]] = File(None),
+    handwritingImage: Optional[List[UploadFile]] = File(None)
 ):
     try:
         # Use VIN number as session ID
         session_id = vinNumber
         
         # Generate ticket history analysis
-        ticket_analysis = generate_ticket_history_analysis(session_id, issueDescription, vinNumber)
+        ticket_analysis, similarity = await run_in_threadpool(
+            run_ticket_step, session_id, vinNumber, issueDescription
+        )
         # ticket_analysis = "1. **Historical Pattern Review**: The VIN MAR3DXS4E03123318 shows multiple ticket entries related to maintenance and technical issues, with varying priorities. The recurring nature of maintenance and technical calls suggests the machine may have ongoing operational challenges.\n\n2. **Issue-Specific Analysis**: There is no past record specifically mentioning engine oil clogs; however, the presence of technical and maintenance calls indicates that operational issues have been addressed. The resolution timeline for technical issues in the past varied between 4-6 hours to 8-10 hours, showing responsiveness in handling critical problems."
         
-        # Store in cache
-        if session_id not in analysis_cache:
-            analysis_cache[session_id] = {}
-        analysis_cache[session_id]['ticket_analysis'] = ticket_analysis
-        analysis_cache[session_id]['issue_description'] = issueDescription
-        
         return {
             "stepNumber": 3,
             "output": ticket_analysis,
+            "cacheReuse": similarity is not None,
+            "similarity": similarity,
             "status": "success",
             "timestamp": datetime.now().isoformat()
         }
@@ -163,36 +348,28 @@ async def ticket_history(
 async def handwritten_analysis(
     vinNumber: str = Form(...),
     issueDescription: str = Form(...),
-    corrosionImage: Optional[UploadFile] = File(None),
-    handwritingImage: Optional[UploadFile] = File(None)
+    corrosionImage: Optional[List[UploadFile]] = File(None),
+    handwritingImage: Optional[List[UploadFile]] = File(None)
 ):
     try:
-        # Save handwriting image if uploaded
-        handwriting_path = "data/handwriting_upload.jpg"
-        if handwritingImage:
-            await save_uploaded_file(handwritingImage, handwriting_path)
+        # Save handwriting images if uploaded
+        await save_uploaded_files(handwritingImage, HANDWRITING_UPLOAD_PATH)
         
         # Use VIN number as session ID
         session_id = vinNumber
         
         # Generate handwritten data analysis
-        handwritten_text, handwritten_analysis, image_path = analyse_handwritten_data(
-            session_id, issueDescription, handwriting_path
-        )
+        handwritten_analysis = await run_in_threadpool(run_handwritten_step, session_id, vinNumber, issueDescription)
         # handwritten_analysis = "**Key Findings:**\n\n1. **Machine Condition:** The machine is reported to be in stable condition with no visible external damage.\n   \n2. **Indicator Light Status:** A red indicator light is noted, suggesting that the machine is currently offline or in standby mode.\n\n3. **Surroundings:** The area around the machine has debris and obstructions. There are no signs of tampering or unauthorized access.\n\n4. **Environmental Factors:** The ambient temperature is described as relatively high, which may potentially impact machine performance. Wind speed is moderate.\n\n5. **Urgent Recommendations:**\n   - Investigate the cause of the red light and attempt to bring the machine back online if it is safe to do so.\n   - Conduct a maintenance inspection focused on addressing efficiency issues and energy loss.\n   - Consider implementing cooling adjustments to alleviate the impact of high ambient temperatures.\n   - Analyze historical data to identify patterns in energy loss.\n\n6. **Additional Observations:** There is a mention that engine oil is clogged, indicating a potential maintenance issue that needs to be addressed.\n\n**Contextual Understanding:**\nThe maintenance notes provide a comprehensive view of the machine's current status, highlighting both operational concerns and environmental conditions that require attention. The urgency surrounding the red indicator light suggests immediate action is needed to restore functionality. Additionally, the presence of debris may point to an ongoing maintenance concern that could lead to further issues if not resolved. The need for a deeper inspection into efficiency and historical energy loss is critical for long-term machine health."
         
-        # Store in cache
-        if session_id not in analysis_cache:
-            analysis_cache[session_id] = {}
-        analysis_cache[session_id]['handwritten_analysis'] = handwritten_analysis
-        analysis_cache[session_id]['issue_description'] = issueDescription
-        
         return {
             "stepNumber": 4,
             "output": handwritten_analysis,
             "status": "success",
             "timestamp": datetime.now().isoformat()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -201,59 +378,17 @@ async def handwritten_analysis(
 async def troubleshooting_steps(
     vinNumber: str = Form(...),
     issueDescription: str = Form(...),
-    corrosionImage: Optional[UploadFile] = File(None),
-    handwritingImage: Optional[UploadFile] = File(None)
+    corrosionImage: Optional[List[UploadFile]] = File(None),
+    handwritingImage: Optional[List[UploadFile]] = File(None)
 ):
     try:
         # Use VIN number as session ID
         session_id = vinNumber
         
-        # Initialize or update cache entry
-        if session_id not in analysis_cache:
-            analysis_cache[session_id] = {}
-        analysis_cache[session_id]['issue_description'] = issueDescription
-        
-        # Retrieve data from cache or regenerate if not available
-        telemetry_analysis = analysis_cache.get(session_id, {}).get('telemetry_analysis')
-        if not telemetry_analysis:
-            telemetry_analysis = generate_telemetry_analysis(session_id, vinNumber, issueDescription)
-            analysis_cache[session_id]['telemetry_analysis'] = telemetry_analysis
-            
-        corrosion_analysis = analysis_cache.get(session_id, {}).get('corrosion_analysis')
-        if not corrosion_analysis:
-            corrosion_path = "data/corrosion_upload.jpg"
-            _, corrosion_analysis = generate_corrosion_analysis(session_id, issueDescription, corrosion_path)
-            analysis_cache[session_id]['corrosion_analysis'] = corrosion_analysis
-            
-        ticket_analysis = analysis_cache.get(session_id, {}).get('ticket_analysis')
-        if not ticket_analysis:
-            ticket_analysis = generate_ticket_history_analysis(session_id, issueDescription, vinNumber)
-            analysis_cache[session_id]['ticket_analysis'] = ticket_analysis
-            
-        handwritten_analysis = analysis_cache.get(session_id, {}).get('handwritten_analysis')
-        if not handwritten_analysis:
-            handwriting_path = "data/handwriting_upload.jpg"
-            _, handwritten_analysis, _ = analyse_handwritten_data(session_id, issueDescription, handwriting_path)
-            analysis_cache[session_id]['handwritten_analysis'] = handwritten_analysis
-        
-        # Placeholder for knowledge graph analysis
-        kg_analysis_output = "Knowledge Graph analysis not available"
-        
-        # Generate troubleshooting steps
-        troubleshooting_result = troubleshoot_issue(
-            session_id,
-            issueDescription,
-            telemetry_analysis,
-            corrosion_analysis,
-            ticket_analysis,
-            kg_analysis_output,
-            handwritten_analysis,
-        ) 
+        # Reuses every upstream result whose inputs are unchanged
+        troubleshooting_result = await run_in_threadpool(run_troubleshooting_step, session_id, vinNumber, issueDescription)
         # troubleshooting_result = "UNRESOLVED\n\nThe issue of clogged engine oil for VIN MAR3DXS4E03123318 cannot be resolved at this time due to the unavailability of the Knowledge Graph analysis. The Knowledge Graph is necessary to provide specific resolution steps, and without it, we cannot retrieve the appropriate measures to address the clogging issue. Additionally, while telemetry and corrosion analyses indicate some contributing factors, the precise corrective actions require a completed Knowledge Graph analysis."
         
-        # Store the troubleshooting result in cache
-        analysis_cache[session_id]['troubleshooting_result'] = troubleshooting_result
-        
         return {
             "stepNumber": 5,
             "output": troubleshooting_result,
@@ -268,65 +403,17 @@ async def troubleshooting_steps(
 async def rca_analysis(
     vinNumber: str = Form(...),
     issueDescription: str = Form(...),
-    corrosionImage: Optional[UploadFile] = File(None),
-    handwritingImage: Optional[UploadFile] = File(None)
+    corrosionImage: Optional[List[UploadFile]] = File(None),
+    handwritingImage: Optional[List[UploadFile]] = File(None)
 ):
     try:
         # Use VIN number as session ID
         session_id = vinNumber
         
-        # Update cache with latest issue description
-        if session_id not in analysis_cache:
-            analysis_cache[session_id] = {}
-        analysis_cache[session_id]['issue_description'] = issueDescription
-        
-        # Get troubleshooting result from cache or generate it if missing
-        troubleshooting_result = analysis_cache.get(session_id, {}).get('troubleshooting_result')
-        if not troubleshooting_result:
-            # We need to generate the troubleshooting result
-            telemetry_analysis = analysis_cache.get(session_id, {}).get('telemetry_analysis')
-            if not telemetry_analysis:
-                telemetry_analysis = generate_telemetry_analysis(session_id, vinNumber, issueDescription)
-                
-            corrosion_analysis = analysis_cache.get(session_id, {}).get('corrosion_analysis')
-            if not corrosion_analysis:
-                corrosion_path = "data/corrosion_upload.jpg"
-                _, corrosion_analysis = generate_corrosion_analysis(session_id, issueDescription, corrosion_path)
-                
-            ticket_analysis = analysis_cache.get(session_id, {}).get('ticket_analysis')
-            if not ticket_analysis:
-                ticket_analysis = generate_ticket_history_analysis(session_id, issueDescription, vinNumber)
-                
-            handwritten_analysis = analysis_cache.get(session_id, {}).get('handwritten_analysis')
-            if not handwritten_analysis:
-                handwriting_path = "data/handwriting_upload.jpg"
-                _, handwritten_analysis, _ = analyse_handwritten_data(session_id, issueDescription, handwriting_path)
-            
-            kg_analysis_output = "Knowledge Graph analysis not available"
-            
-            troubleshooting_result = troubleshoot_issue(
-                session_id,
-                issueDescription,
-                telemetry_analysis or "Telemetry data not available",
-                corrosion_analysis or "Corrosion analysis not available",
-                ticket_analysis or "Ticket history not available",
-                kg_analysis_output,
-                handwritten_analysis or "Handwritten analysis not available",
-            )
-            analysis_cache[session_id]['troubleshooting_result'] = troubleshooting_result
-        
-        # Generate manager analysis
-        manager_analysis = generate_manager_analysis(
-            session_id,
-            issueDescription,
-            troubleshooting_result,
-            vinNumber,
-        )
+        # Generate manager analysis (recomputes troubleshooting only if its inputs changed)
+        manager_analysis = await run_in_threadpool(run_manager_step, session_id, vinNumber, issueDescription)
         # manager_analysis = "VIN: MAR3DXS4E03123318  \nIssue: Engine oil is clogged  \n\nAdvanced Troubleshooting Steps:  \n1. Check and top up the engine oil level, using the correct oil grade.  \n2. Replace the oil filter to restore proper oil flow.  \n3. Inspect engine seals and gaskets for leaks; repair or replace any damaged parts.  \n4. Test oil pump performance with a pressure gauge; replace the pump if it fails to meet specifications.  \n5. Clean internal oil passages to remove sludge or debris buildup.  \n6. Verify the accuracy of the oil pressure sensor and replace it if readings are out of tolerance."
         
-        # Store the manager analysis in cache
-        analysis_cache[session_id]['manager_analysis'] = manager_analysis
-        
         return {
             "stepNumber": 6,
             "output": manager_analysis,
@@ -349,16 +436,184 @@ step_agent_id_mapping = {
 @app.post("/api/steps/feedback", response_model=FeedbackResponse)
 async def submit_feedback(feedback_request: FeedbackRequest):
     try:
+        if feedback_request.stepNumber not in step_agent_id_mapping:
+            raise HTTPException(status_code=400, detail=f"Unknown step number: {feedback_request.stepNumber}")
         user_input = "VIN: " + feedback_request.vinNumber + " " + "Issue: " + feedback_request.issueDescription
-        feedback_response = send_feedback(user_input, feedback_request.agent_output, feedback_request.feedback, step_agent_id_mapping[feedback_request.stepNumber])
+        # Persist locally and acknowledge; the background flusher delivers it upstream
+        feedback_spool.append(
+            user_input,
+            feedback_request.agent_output,
+            feedback_request.feedback,
+            step_agent_id_mapping[feedback_request.stepNumber],
+            feedback_request.stepNumber,
+        )
         return FeedbackResponse(
             stepNumber=feedback_request.stepNumber,
             feedbackReceived=True,
             timestamp=datetime.now().isoformat()
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Feedback spool metrics
+@app.get("/api/metrics/feedback")
+async def feedback_metrics():
+    return feedback_spool.metrics()
+
+# Image preprocessing metrics
+@app.get("/api/metrics/images")
+async def image_metrics():
+    return preprocessing_stats()
+
+# Step result cache metrics
+@app.get("/api/metrics/cache")
+async def cache_metrics():
+    return analysis_cache.metrics()
+
+# Semantic response cache metrics
+@app.get("/api/metrics/semantic-cache")
+async def semantic_cache_metrics():
+    return semantic_cache.metrics()
+
+# Knowledge graph lookup
+@app.get("/api/knowledge-graph")
+async def knowledge_graph_analysis(vinNumber: str, issueDescription: str):
+    return {
+        "output": knowledge_graph.analyse(vinNumber, issueDescription),
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Incremental knowledge graph update for a newly raised ticket
+# New ticket: updates the knowledge graph, spatial index, ticket analytics and
+# admission priority. The knowledge-graph path is kept for existing callers.
+@app.post("/api/tickets")
+@app.post("/api/knowledge-graph/tickets")
+async def add_ticket(ticket: TicketRecord):
+    try:
+        knowledge_graph.add_ticket(ticket.model_dump())
+        spatial_index.add_ticket(ticket.model_dump())
+        ticket_analytics.add_ticket(ticket.model_dump())
+        admission_controller.update_priority(ticket.VinNumber, ticket_priority=ticket.Priority)
+        return {"status": "success", "timestamp": datetime.now().isoformat()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/metrics/knowledge-graph")
+async def knowledge_graph_metrics():
+    return knowledge_graph.metrics()
+
+# Streaming telemetry ingest: NDJSON (default) or CSV with a header row
+@app.post("/api/telemetry/ingest")
+async def ingest_telemetry(request: Request):
+    content_type = request.headers.get("content-type", "")
+    try:
+        body = (await request.body()).decode("utf-8")
+        if "csv" in content_type:
+            accepted, rejected = await run_in_threadpool(profiled(telemetry_stream.ingest_csv), body)
+        else:
+            accepted, rejected = await run_in_threadpool(profiled(telemetry_stream.ingest_ndjson), body)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "accepted": accepted,
+        "rejected": rejected,
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Current rolling telemetry state for one machine
+@app.get("/api/telemetry/{vinNumber}")
+async def telemetry_state(vinNumber: str):
+    state = telemetry_stream.state(vinNumber)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"No telemetry for VIN {vinNumber}")
+    return state
+
+@app.get("/api/metrics/telemetry-stream")
+async def telemetry_stream_metrics():
+    return telemetry_stream.metrics()
+
+# Ticket recurrence / MTBF analytics
+@app.get("/api/ticket-analytics")
+async def fleet_ticket_analytics():
+    return ticket_analytics.fleet_stats()
+
+@app.get("/api/ticket-analytics/{vinNumber}")
+async def vin_ticket_analytics(vinNumber: str):
+    stats = ticket_analytics.vin_stats(vinNumber)
+    if stats is None:
+        raise HTTPException(status_code=404, detail=f"No tickets for VIN {vinNumber}")
+    return {"vinNumber": vinNumber, **stats, "summary": ticket_analytics.summary(vinNumber)}
+
+# Nearby machines by VIN or by point, with their ticket history and findings
+@app.get("/api/spatial/nearby")
+async def nearby_machines(
+    vinNumber: Optional[str] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    k: Optional[int] = None,
+    radiusKm: Optional[float] = None,
+):
+    if vinNumber is None and (lat is None or lon is None):
+        raise HTTPException(status_code=400, detail="Provide vinNumber or both lat and lon")
+    result = spatial_index.nearby(vinNumber, lat, lon, k, radiusKm)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No location on record for VIN {vinNumber}")
+    return result
+
+@app.get("/api/metrics/spatial")
+async def spatial_metrics():
+    return spatial_index.metrics()
+
+# Speculative prefetch metrics (hit / waste ratios)
+@app.get("/api/metrics/prefetch")
+async def prefetch_metrics():
+    return {**prefetcher.metrics(), **analysis_cache.prefetch_metrics()}
+
+# Agent admission control metrics (queue wait per priority class)
+@app.get("/api/metrics/admission")
+async def admission_metrics():
+    return admission_controller.metrics()
+
+# Stored request profiles (admin)
+def check_profiling_admin(token: Optional[str]):
+    if not settings.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not settings.PROFILING_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="PROFILING_ADMIN_TOKEN is not configured")
+    if token != settings.PROFILING_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/api/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    check_profiling_admin(x_admin_token)
+    return await run_in_threadpool(profile_store.list)
+
+@app.get("/api/admin/profiles/{profileId}")
+async def download_profile(
+    profileId: str,
+    format: str = "speedscope",
+    x_admin_token: Optional[str] = Header(None),
+):
+    check_profiling_admin(x_admin_token)
+    if format not in ("speedscope", "pstats"):
+        raise HTTPException(status_code=400, detail="format must be speedscope or pstats")
+    record = await run_in_threadpool(profile_store.load, profileId)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profileId} not found")
+    if format == "pstats":
+        return Response(
+            content=to_pstats(record),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{profileId}.prof"'},
+        )
+    return Response(
+        content=json.dumps(to_speedscope(record)),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{profileId}.speedscope.json"'},
+    )
+
 # Root endpoint
 @app.get("/")
 async def root():
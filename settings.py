@@ -24,6 +24,71 @@ class Settings:
         self.FEEDBACK_RAG_ID = os.getenv("FEEDBACK_RAG_ID")
         self.AGENT_LEARNING_FEEDBACK_URL = os.getenv("AGENT_LEARNING_FEEDBACK_URL")
 
+        # Feedback spool
+        self.FEEDBACK_SPOOL_PATH = os.getenv("FEEDBACK_SPOOL_PATH", "data/feedback_spool.jsonl")
+        self.FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "5"))
+        self.FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "20"))
+        self.FEEDBACK_MAX_RETRIES = int(os.getenv("FEEDBACK_MAX_RETRIES", "3"))
+        # A record that keeps failing (not rejected) is dead-lettered only after this long
+        self.FEEDBACK_DEAD_LETTER_HOURS = float(os.getenv("FEEDBACK_DEAD_LETTER_HOURS", "24"))
+
+        # Image preprocessing before OCR / corrosion upload
+        self.IMAGE_PREPROCESSING_ENABLED = os.getenv("IMAGE_PREPROCESSING_ENABLED", "true").lower() == "true"
+        self.IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1600"))
+        self.IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+        self.OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "true").lower() == "true"
+        # Multi-image steps: images accepted per upload, and concurrent OCR/detection calls
+        self.IMAGE_BATCH_MAX_IMAGES = int(os.getenv("IMAGE_BATCH_MAX_IMAGES", "10"))
+        self.IMAGE_BATCH_CONCURRENCY = int(os.getenv("IMAGE_BATCH_CONCURRENCY", "4"))
+
+        # Similarity cache over issue descriptions for the telemetry and ticket agents (opt-in)
+        self.SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+        self.SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+        self.SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "64"))
+
+        # Fleet data and knowledge graph
+        self.TELEMETRY_DATA_PATH = os.getenv("TELEMETRY_DATA_PATH", "data/POC Telemetry Data.csv")
+        self.TICKET_DATA_PATH = os.getenv("TICKET_DATA_PATH", "data/POC Ticketing Data_augmented.csv")
+        self.KG_CATALOGUE_PATH = os.getenv("KG_CATALOGUE_PATH", "data/kg_catalogue.json")
+        # Columnar fleet store written by `python fleet_store.py ingest`
+        self.FLEET_STORE_PATH = os.getenv("FLEET_STORE_PATH", "data/fleet_store")
+        self.FLEET_STORE_BUCKETS = int(os.getenv("FLEET_STORE_BUCKETS", "16"))
+
+        # Streaming telemetry: rolling per-VIN aggregates, optionally fed by tailing a file
+        self.TELEMETRY_EWMA_ALPHA = float(os.getenv("TELEMETRY_EWMA_ALPHA", "0.3"))
+        self.TELEMETRY_TAIL_PATH = os.getenv("TELEMETRY_TAIL_PATH")
+        self.TELEMETRY_TAIL_INTERVAL = float(os.getenv("TELEMETRY_TAIL_INTERVAL", "1"))
+
+        # Spatial index over machine Coordinates (nearby machines with the same issue)
+        self.SPATIAL_CELL_DEGREES = float(os.getenv("SPATIAL_CELL_DEGREES", "1"))
+        self.SPATIAL_NEARBY_K = int(os.getenv("SPATIAL_NEARBY_K", "5"))
+        self.SPATIAL_RADIUS_KM = float(os.getenv("SPATIAL_RADIUS_KM", "500"))
+
+        # Admission control in front of the Lyzr agents (opt-in)
+        self.ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "false").lower() == "true"
+        self.AGENT_RATE_LIMIT_PER_SECOND = float(os.getenv("AGENT_RATE_LIMIT_PER_SECOND", "2"))
+        self.AGENT_RATE_LIMIT_BURST = int(os.getenv("AGENT_RATE_LIMIT_BURST", "5"))
+        # Optional per-agent overrides as JSON: {"<agent_id>": [rate_per_second, burst]}
+        self.AGENT_RATE_LIMITS = os.getenv("AGENT_RATE_LIMITS", "{}")
+        self.ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "60"))
+        # Threads allowed to block waiting for admission; non-urgent callers beyond
+        # this are refused at once. Keep it below the server's worker thread limit
+        # (40 by default) so urgent requests can still get a thread.
+        self.ADMISSION_MAX_WAITERS = int(os.getenv("ADMISSION_MAX_WAITERS", "24"))
+
+        # Speculative prefetch of steps 2-4 when step 1 arrives (opt-in)
+        self.PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "false").lower() == "true"
+        self.PREFETCH_BUDGET = int(os.getenv("PREFETCH_BUDGET", "6"))
+
+        # Opt-in request profiling: requests carrying PROFILE_HEADER are sampled
+        self.PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+        self.PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+        # Required: without it nothing is profiled and the admin endpoints refuse
+        self.PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN")
+        self.PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+        self.PROFILE_STORE_PATH = os.getenv("PROFILE_STORE_PATH", "data/profiles")
+        self.PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "20"))
+
     def __getattr__(self, name):
         """Return None if attribute doesn't exist"""
         return None
@@ -0,0 +1,236 @@
+import math
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+from fleet_data import load_telemetry, load_tickets
+from settings import settings
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Number of recent queries kept for latency metrics
+MAX_LATENCY_SAMPLES = 1000
+# Length of a recorded finding kept per machine
+MAX_FINDING_CHARS = 200
+
+
+def parse_coordinates(value):
+    """(lat, lon) from a "lat, lon" telemetry string, or None."""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    try:
+        lat, lon = (float(part) for part in str(value).split(","))
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialIndex:
+    """Fixed lat/lon grid over machine positions, joined with ticket history.
+
+    A radius query only visits the cells overlapping the circle's bounding
+    box, and k-nearest widens the radius until k machines are inside it, so
+    neither scans the fleet. Positions, tickets and per-machine findings
+    (e.g. the latest corrosion analysis) can all be updated in place.
+    """
+
+    def __init__(self, cell_degrees):
+        self.cell_degrees = cell_degrees
+        self._lon_cells = math.ceil(360 / cell_degrees)
+        self._cells = {}
+        self._positions = {}
+        # vin -> {CallType: count}
+        self._call_types = {}
+        # vin -> (kind, text) of the latest recorded finding
+        self._findings = {}
+        self._lock = threading.Lock()
+        self.queries = 0
+        self._latencies = deque(maxlen=MAX_LATENCY_SAMPLES)
+
+    def _cell(self, lat, lon):
+        return (
+            math.floor((lat + 90) / self.cell_degrees),
+            math.floor((lon + 180) / self.cell_degrees) % self._lon_cells,
+        )
+
+    # Updates
+    def update_position(self, vin, lat, lon):
+        cell = self._cell(lat, lon)
+        with self._lock:
+            previous = self._positions.get(vin)
+            if previous is not None:
+                self._cells[previous[2]].discard(vin)
+            self._positions[vin] = (lat, lon, cell)
+            self._cells.setdefault(cell, set()).add(vin)
+
+    def add_telemetry(self, record):
+        position = parse_coordinates(record.get("Coordinates"))
+        if position is not None:
+            self.update_position(str(record["VinNumber"]), *position)
+
+    def add_ticket(self, record):
+        call_type = record.get("CallType")
+        if call_type is None or (isinstance(call_type, float) and pd.isna(call_type)):
+            return
+        with self._lock:
+            counts = self._call_types.setdefault(str(record["VinNumber"]), {})
+            counts[call_type] = counts.get(call_type, 0) + 1
+
+    def record_finding(self, vin, kind, text):
+        with self._lock:
+            self._findings[vin] = (kind, " ".join(str(text).split())[:MAX_FINDING_CHARS])
+
+    def load_fleet(self, telemetry, tickets):
+        for record in telemetry[["VinNumber", "Coordinates"]].to_dict("records"):
+            self.add_telemetry(record)
+        for record in tickets[["VinNumber", "CallType"]].to_dict("records"):
+            self.add_ticket(record)
+
+    # Queries
+    def _within(self, lat, lon, radius_km):
+        # Caller holds the lock. Bounding box of the spherical cap, in cells.
+        lat_span = radius_km / KM_PER_DEGREE
+        lat_low, lat_high = max(-90.0, lat - lat_span), min(90.0, lat + lat_span)
+        angular = radius_km / EARTH_RADIUS_KM
+        if lat_low <= -90 or lat_high >= 90 or angular >= math.pi / 2:
+            lon_cells = range(self._lon_cells)
+        else:
+            ratio = math.sin(angular) / math.cos(math.radians(lat))
+            if ratio >= 1:
+                lon_cells = range(self._lon_cells)
+            else:
+                lon_span = math.degrees(math.asin(ratio))
+                first = math.floor((lon - lon_span + 180) / self.cell_degrees)
+                last = math.floor((lon + lon_span + 180) / self.cell_degrees)
+                if last - first + 1 >= self._lon_cells:
+                    lon_cells = range(self._lon_cells)
+                else:
+                    lon_cells = [index % self._lon_cells for index in range(first, last + 1)]
+        lat_first = self._cell(lat_low, 0)[0]
+        lat_last = self._cell(lat_high, 0)[0]
+
+        found = []
+        for lat_index in range(lat_first, lat_last + 1):
+            for lon_index in lon_cells:
+                for vin in self._cells.get((lat_index, lon_index), ()):
+                    other_lat, other_lon, _ = self._positions[vin]
+                    distance = haversine_km(lat, lon, other_lat, other_lon)
+                    if distance <= radius_km:
+                        found.append((distance, vin))
+        return found
+
+    def radius(self, lat, lon, radius_km):
+        """[(distance_km, vin)] within radius_km, nearest first."""
+        with self._lock:
+            return sorted(self._within(lat, lon, radius_km))
+
+    def nearest(self, lat, lon, k, max_radius_km=None, exclude=()):
+        """Up to k nearest [(distance_km, vin)], optionally capped at max_radius_km."""
+        limit = max_radius_km or math.pi * EARTH_RADIUS_KM
+        radius_km = min(limit, 2 * self.cell_degrees * KM_PER_DEGREE)
+        with self._lock:
+            while True:
+                # Everything within radius_km is found, so once k are inside
+                # the circle they are the k nearest
+                found = [item for item in self._within(lat, lon, radius_km) if item[1] not in exclude]
+                if len(found) >= k or radius_km >= limit:
+                    return sorted(found)[:k]
+                radius_km = min(limit, radius_km * 2)
+
+    def nearby(self, vin=None, lat=None, lon=None, k=None, radius_km=None):
+        """Nearest machines to a VIN (or a point) with their ticket history and findings."""
+        start = time.perf_counter()
+        k = k or settings.SPATIAL_NEARBY_K
+        radius_km = radius_km or settings.SPATIAL_RADIUS_KM
+        if vin is not None:
+            with self._lock:
+                position = self._positions.get(vin)
+            if position is None:
+                return None
+            lat, lon = position[0], position[1]
+        neighbours = self.nearest(lat, lon, k, radius_km, exclude=(vin,))
+        with self._lock:
+            own_call_types = set(self._call_types.get(vin, {}))
+            results = []
+            for distance, other in neighbours:
+                call_types = dict(self._call_types.get(other, {}))
+                finding = self._findings.get(other)
+                results.append({
+                    "vin": other,
+                    "distance_km": round(distance, 1),
+                    "call_types": call_types,
+                    "shared_call_types": sorted(own_call_types & set(call_types)),
+                    "finding": {"kind": finding[0], "text": finding[1]} if finding else None,
+                })
+            self.queries += 1
+            self._latencies.append(time.perf_counter() - start)
+        return {"vin": vin, "lat": lat, "lon": lon, "radius_km": radius_km, "machines": results}
+
+    def nearby_context(self, vin, kind=None, findings=True):
+        """Plain-text nearby-machine context for agent prompts.
+
+        findings=False leaves out the neighbours' latest findings. Those are
+        free agent text that changes on every neighbour's run, so cache keys
+        use this stable form while prompts get the full one.
+        """
+        result = self.nearby(vin)
+        if result is None:
+            return f"No location on record for VIN {vin}."
+        machines = result["machines"]
+        if not machines:
+            return f"No other machines within {result['radius_km']:g} km."
+        lines = [f"Nearest machines within {result['radius_km']:g} km:"]
+        for machine in machines:
+            tickets = ", ".join(
+                f"{count} {call_type}" for call_type, count in sorted(machine["call_types"].items())
+            ) or "no tickets"
+            line = f"- {machine['vin']} ({machine['distance_km']:g} km): {tickets}"
+            if machine["shared_call_types"]:
+                line += f"; same call types: {', '.join(machine['shared_call_types'])}"
+            finding = machine["finding"] if findings else None
+            if finding and (kind is None or finding["kind"] == kind):
+                line += f"; {finding['kind']}: {finding['text']}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            machines = len(self._positions)
+            cells = sum(1 for vins in self._cells.values() if vins)
+            findings = len(self._findings)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+        return {
+            "machines": machines,
+            "occupied_cells": cells,
+            "cell_degrees": self.cell_degrees,
+            "findings": findings,
+            "queries": self.queries,
+            "query_ms_avg": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+            "query_ms_p95": 1000 * p95,
+        }
+
+
+def build_spatial_index():
+    index = SpatialIndex(settings.SPATIAL_CELL_DEGREES)
+    try:
+        index.load_fleet(load_telemetry(), load_tickets())
+    except FileNotFoundError as e:
+        print(f"Spatial index fleet data not found: {e}")
+    return index
+
+
+spatial_index = build_spatial_index()
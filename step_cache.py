@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+
+def file_sha256(path):
+    """Hash a file's contents, or return None when it does not exist."""
+    if not path or not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_error(output):
+    """Whether a step output is a failed agent call ("Error: ..."), alone or inside a result tuple."""
+    if isinstance(output, (list, tuple)):
+        return any(is_error(item) for item in output)
+    return isinstance(output, str) and output.startswith("Error:")
+
+
+def fingerprint(*parts):
+    """Stable hash of a step's exact inputs (including upstream fingerprints)."""
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class StepCache:
+    """Per-session step outputs, each stored with the fingerprint of its inputs.
+
+    A cached output is only reused when the fingerprint matches, so changing
+    the issue text or an image recomputes exactly the steps that depend on it
+    (downstream steps include upstream results in their own fingerprint). Concurrent
+    requests for the same step and fingerprint attach to the computation
+    already in flight instead of calling the agent again.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._inflight = {}
+        # (session_id, step) -> fingerprint of prefetched outputs nobody has used yet
+        self._unused_prefetches = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.attached = 0
+        self.prefetch_completed = 0
+        self.prefetch_hits = 0
+        self.prefetch_wasted = 0
+        self.prefetch_recomputed = 0
+
+    def _consume_prefetch(self, session_id, step, step_fingerprint):
+        if self._unused_prefetches.get((session_id, step)) == step_fingerprint:
+            del self._unused_prefetches[(session_id, step)]
+            self.prefetch_hits += 1
+
+    def _store(self, session_id, step, step_fingerprint, output, prefetch):
+        # Caller holds the lock. Failed agent calls are not cached so the
+        # next request retries them.
+        if is_error(output):
+            return
+        unused = self._unused_prefetches.pop((session_id, step), None)
+        if unused is not None and unused != step_fingerprint:
+            self.prefetch_wasted += 1
+        if prefetch:
+            self._unused_prefetches[(session_id, step)] = step_fingerprint
+        self._entries.setdefault(session_id, {})[step] = (step_fingerprint, output)
+
+    def get_or_compute(self, session_id, step, step_fingerprint, compute, prefetch=False):
+        key = (session_id, step, step_fingerprint)
+        owner = False
+        used_prefetch = False
+        with self._lock:
+            entry = self._entries.get(session_id, {}).get(step)
+            if entry and entry[0] == step_fingerprint:
+                self.hits += 1
+                if not prefetch:
+                    self._consume_prefetch(session_id, step, step_fingerprint)
+                return entry[1]
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                self.attached += 1
+                if not prefetch and inflight["prefetch"] and not inflight["consumed"]:
+                    inflight["consumed"] = True
+                    used_prefetch = True
+            else:
+                self.misses += 1
+                inflight = {"future": Future(), "prefetch": prefetch, "consumed": False}
+                self._inflight[key] = inflight
+                owner = True
+        if not owner:
+            output = inflight["future"].result()
+            if not used_prefetch:
+                return output
+            # A prefetch that failed (e.g. refused admission as speculative)
+            # is redone at this request's own priority
+            if not is_error(output):
+                with self._lock:
+                    self.prefetch_hits += 1
+                return output
+            with self._lock:
+                self.prefetch_recomputed += 1
+            return self.get_or_compute(session_id, step, step_fingerprint, compute)
+
+        try:
+            output = compute()
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            inflight["future"].set_exception(e)
+            raise
+        with self._lock:
+            if prefetch:
+                self.prefetch_completed += 1
+            # A request that attached while this was running already used the prefetch
+            self._store(
+                session_id, step, step_fingerprint, output,
+                prefetch and not inflight["consumed"],
+            )
+            self._inflight.pop(key, None)
+        inflight["future"].set_result(output)
+        return output
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "sessions": len(self._entries),
+                "entries": sum(len(steps) for steps in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "attached_to_inflight": self.attached,
+                "inflight": len(self._inflight),
+            }
+
+    def prefetch_metrics(self):
+        with self._lock:
+            completed = self.prefetch_completed
+            return {
+                "completed": completed,
+                "hits": self.prefetch_hits,
+                "wasted": self.prefetch_wasted,
+                "recomputed": self.prefetch_recomputed,
+                "unused": len(self._unused_prefetches),
+                "hit_ratio": self.prefetch_hits / completed if completed else 0.0,
+                "waste_ratio": self.prefetch_wasted / completed if completed else 0.0,
+            }
@@ -0,0 +1,332 @@
+import csv
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from fleet_data import load_telemetry, parse_number
+from settings import settings
+
+# Readings with rolling min / max / EWMA
+ROLLING_FIELDS = (
+    "EngineOilPressure",
+    "EngineCoolantTemperture",
+    "MachineBattery",
+    "FuelConsumptionRate",
+)
+# Cumulative counters whose change between syncs is tracked
+ALERT_COUNT_FIELDS = (
+    "HealthAlertCounts",
+    "ServiceAlertCounts",
+    "SecurityAlertCounts",
+    "UtilizationAlertCounts",
+)
+SYNC_FIELD = "LastSynchDateTime"
+# Sync timestamp formats: the snapshot CSV's, then ISO 8601
+SYNC_FORMATS = ("%d-%b-%Y", "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S")
+
+
+def parse_sync_time(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if isinstance(value, datetime):
+        return None if pd.isna(value) else value.replace(tzinfo=None)
+    text = str(value).strip()
+    for fmt in SYNC_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+class Rolling:
+    __slots__ = ("min", "max", "ewma", "last")
+
+    def __init__(self, value):
+        self.min = self.max = self.ewma = self.last = value
+
+    def update(self, value, alpha, in_order):
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        # A late record still widens the range but must not move current state
+        if in_order:
+            self.ewma = alpha * value + (1 - alpha) * self.ewma
+            self.last = value
+
+    def as_dict(self):
+        return {"last": self.last, "min": self.min, "max": self.max, "ewma": round(self.ewma, 3)}
+
+
+class VinState:
+    """Current state of one machine, updated in constant time per record."""
+
+    __slots__ = ("latest", "synced_at", "rolling", "alert_counts", "alert_deltas", "alert_increase", "records", "version")
+
+    def __init__(self):
+        self.latest = {}
+        self.synced_at = None
+        self.rolling = {}
+        self.alert_counts = {}
+        # Change at the most recent sync, and total increase since first seen
+        self.alert_deltas = {}
+        self.alert_increase = {}
+        self.records = 0
+        self.version = 0
+
+    def as_dict(self):
+        return {
+            "records": self.records,
+            "version": self.version,
+            "last_synced_at": self.synced_at.isoformat() if self.synced_at else None,
+            "alert_status": self.latest.get("AlertStatus"),
+            "engine_status": self.latest.get("EngineStatus"),
+            "readings": {field: rolling.as_dict() for field, rolling in self.rolling.items()},
+            "alert_counts": dict(self.alert_counts),
+            "alert_deltas": dict(self.alert_deltas),
+            "alert_increase": dict(self.alert_increase),
+        }
+
+
+class TelemetryStream:
+    """Per-VIN rolling telemetry aggregates fed by batches or a tailed file.
+
+    Each record updates its machine's min/max/EWMA readings and alert count
+    deltas in place, so reading a machine's current state never rescans
+    history. Subscribers are called with the merged latest record so other
+    in-memory views (knowledge graph, admission priorities) stay current.
+    """
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self._states = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.tail_path = None
+        self.tail_offset = 0
+        self.ingested = 0
+        self.rejected = 0
+        self.out_of_order = 0
+        self.ingest_seconds = 0.0
+        self.last_error = None
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    # Ingest
+    def _apply(self, record):
+        # Caller holds the lock
+        vin = record.get("VinNumber")
+        if vin is None or (isinstance(vin, float) and pd.isna(vin)) or not str(vin).strip():
+            self.rejected += 1
+            return None
+        vin = str(vin).strip()
+        state = self._states.get(vin)
+        if state is None:
+            state = self._states[vin] = VinState()
+
+        synced_at = parse_sync_time(record.get(SYNC_FIELD))
+        in_order = synced_at is None or state.synced_at is None or synced_at >= state.synced_at
+        if not in_order:
+            self.out_of_order += 1
+
+        for field in ROLLING_FIELDS:
+            value = parse_number(record.get(field))
+            if value is None:
+                continue
+            if field in state.rolling:
+                state.rolling[field].update(value, self.alpha, in_order)
+            else:
+                state.rolling[field] = Rolling(value)
+
+        if in_order:
+            for field in ALERT_COUNT_FIELDS:
+                value = parse_number(record.get(field))
+                if value is None:
+                    continue
+                previous = state.alert_counts.get(field)
+                if previous is not None:
+                    state.alert_deltas[field] = value - previous
+                    state.alert_increase[field] = state.alert_increase.get(field, 0) + max(value - previous, 0)
+                state.alert_counts[field] = value
+            state.latest.update(
+                (key, value) for key, value in record.items()
+                if not (isinstance(value, float) and pd.isna(value))
+            )
+            state.latest["VinNumber"] = vin
+            if synced_at is not None:
+                state.synced_at = synced_at
+            state.version += 1
+        state.records += 1
+        self.ingested += 1
+        return vin, in_order
+
+    def ingest(self, records):
+        """Apply records in order; returns (accepted, rejected)."""
+        start = time.perf_counter()
+        accepted = 0
+        updated = set()
+        with self._lock:
+            rejected_before = self.rejected
+            for record in records:
+                if not isinstance(record, dict):
+                    self.rejected += 1
+                    continue
+                applied = self._apply(record)
+                if applied is None:
+                    continue
+                accepted += 1
+                vin, in_order = applied
+                if in_order:
+                    updated.add(vin)
+            rejected = self.rejected - rejected_before
+            self.ingest_seconds += time.perf_counter() - start
+            # Subscribers get one call per VIN with its newest state, not one per record
+            snapshots = [dict(self._states[vin].latest) for vin in updated]
+        for snapshot in snapshots:
+            for callback in self._subscribers:
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    print(f"Telemetry subscriber failed: {e}")
+        return accepted, rejected
+
+    def ingest_ndjson(self, text):
+        records = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                records.append(None)
+        return self.ingest(records)
+
+    def ingest_csv(self, text, fieldnames=None):
+        return self.ingest(list(csv.DictReader(io.StringIO(text), fieldnames=fieldnames)))
+
+    def load_snapshot(self, telemetry):
+        """Seed state from the static snapshot (one row per VIN)."""
+        self.ingest(telemetry.to_dict("records"))
+
+    # Reads
+    def version(self, vin):
+        with self._lock:
+            state = self._states.get(vin)
+            return state.version if state else 0
+
+    def state(self, vin):
+        with self._lock:
+            state = self._states.get(vin)
+            return state.as_dict() if state else None
+
+    def summary(self, vin):
+        """Plain-text current state for the telemetry prompt, or None for unknown VINs."""
+        state = self.state(vin)
+        if state is None:
+            return None
+        lines = [
+            f"AlertStatus {state['alert_status']}, EngineStatus {state['engine_status']}, "
+            f"last synced {state['last_synced_at']}, {state['records']} records"
+        ]
+        for field, reading in state["readings"].items():
+            lines.append(
+                f"{field}: last {reading['last']}, min {reading['min']}, "
+                f"max {reading['max']}, EWMA {reading['ewma']}"
+            )
+        if state["alert_counts"]:
+            counts = ", ".join(
+                f"{field} {count:g} ({state['alert_deltas'].get(field, 0):+g} since previous sync)"
+                for field, count in state["alert_counts"].items()
+            )
+            lines.append(f"Alert counts: {counts}")
+        return "\n".join(lines)
+
+    # File tail mode
+    def _read_new_lines(self, fieldnames):
+        size = os.path.getsize(self.tail_path)
+        if size < self.tail_offset:
+            # Truncated or rotated: start over from the beginning
+            self.tail_offset = 0
+            fieldnames = None
+        with open(self.tail_path, "rb") as f:
+            f.seek(self.tail_offset)
+            data = f.read()
+        # Leave a partially written last line for the next poll
+        end = data.rfind(b"\n") + 1
+        if not end:
+            return fieldnames
+        self.tail_offset += end
+        text = data[:end].decode("utf-8")
+        if self.tail_path.lower().endswith(".csv"):
+            if fieldnames is None:
+                header, _, text = text.partition("\n")
+                fieldnames = next(csv.reader([header]))
+            self.ingest_csv(text, fieldnames)
+        else:
+            self.ingest_ndjson(text)
+        return fieldnames
+
+    def _tail(self, interval):
+        fieldnames = None
+        while not self._stop.is_set():
+            try:
+                if os.path.exists(self.tail_path):
+                    fieldnames = self._read_new_lines(fieldnames)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Telemetry tail failed: {e}")
+            self._stop.wait(interval)
+
+    def start_tail(self, path, interval):
+        """Follow an NDJSON (or .csv) file, replaying it from the start."""
+        if self._thread and self._thread.is_alive():
+            return
+        self.tail_path = path
+        self.tail_offset = 0
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._tail, args=(interval,), name="telemetry-tail", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "vins": len(self._states),
+                "ingested": self.ingested,
+                "rejected": self.rejected,
+                "out_of_order": self.out_of_order,
+                "ingest_us_per_record": 1e6 * self.ingest_seconds / self.ingested if self.ingested else 0.0,
+                "ewma_alpha": self.alpha,
+                "tail_path": self.tail_path,
+                "tail_offset": self.tail_offset,
+                "tail_running": bool(self._thread and self._thread.is_alive()),
+                "last_error": self.last_error,
+            }
+
+
+def build_telemetry_stream():
+    stream = TelemetryStream(settings.TELEMETRY_EWMA_ALPHA)
+    try:
+        stream.load_snapshot(load_telemetry())
+    except FileNotFoundError as e:
+        print(f"Telemetry snapshot not found: {e}")
+    return stream
+
+
+telemetry_stream = build_telemetry_stream()
@@ -0,0 +1,28 @@
+import re
+
+_token_pattern = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset(
+    "a an and are at be for from has have in is it of on or the this to was with".split()
+)
+
+
+def stem(token):
+    """Crude suffix stripping so "clogged"/"clogging"/"clogs" share one form."""
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(token) > len(suffix) + 2 and token.endswith(suffix):
+            token = token[: -len(suffix)]
+            # "clogg" -> "clog", "stopp" -> "stop"
+            if len(token) > 2 and token[-1] == token[-2] and token[-1] not in "lsz":
+                token = token[:-1]
+            return token
+    return token
+
+
+def tokenize(text):
+    """Lower-cased, stemmed word tokens without stop words."""
+    return [
+        stem(token)
+        for token in _token_pattern.findall(str(text).lower())
+        if token not in STOP_WORDS
+    ]
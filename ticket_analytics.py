@@ -0,0 +1,325 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from fleet_data import load_tickets
+
+# Minimum number of inter-failure intervals before a trend is reported
+MIN_TREND_INTERVALS = 3
+# Relative change in interval length per failure that counts as a trend
+TREND_THRESHOLD = 0.1
+# Months of fleet ticket counts used for the fleet trend
+FLEET_TREND_MONTHS = 12
+
+COLUMNS = ["VinNumber", "CallPlaced", "CallType", "Priority"]
+
+
+def _days(value):
+    return None if pd.isna(value) else round(float(value), 1)
+
+
+def _date(value):
+    return None if pd.isna(value) else value.strftime("%d-%m-%Y")
+
+
+def _trend(slope, mean_interval, intervals):
+    if intervals < MIN_TREND_INTERVALS or pd.isna(slope) or not mean_interval:
+        return "insufficient history"
+    change = slope / mean_interval
+    if change < -TREND_THRESHOLD:
+        return "accelerating"
+    if change > TREND_THRESHOLD:
+        return "slowing"
+    return "stable"
+
+
+def compute_vin_stats(tickets):
+    """Per-VIN inter-failure intervals, MTBF, CallType recurrence and trend.
+
+    Vectorized over the whole frame: intervals come from a grouped diff of
+    the sorted CallPlaced column and the trend is the least-squares slope of
+    interval length against failure number, computed from grouped sums.
+    """
+    frame = tickets[COLUMNS].dropna(subset=["VinNumber"]).sort_values(
+        ["VinNumber", "CallPlaced"], kind="stable"
+    )
+    dated = frame.dropna(subset=["CallPlaced"])
+    dated = dated.assign(
+        interval=dated.groupby("VinNumber")["CallPlaced"].diff().dt.total_seconds() / 86400,
+        type_interval=dated.groupby(["VinNumber", "CallType"])["CallPlaced"].diff().dt.total_seconds() / 86400,
+    )
+    intervals = dated.dropna(subset=["interval"])
+    intervals = intervals.assign(position=intervals.groupby("VinNumber").cumcount().astype(float))
+    intervals = intervals.assign(
+        xy=intervals["position"] * intervals["interval"],
+        xx=intervals["position"] ** 2,
+    )
+
+    counts = frame.groupby("VinNumber").agg(
+        tickets=("CallType", "size"), first=("CallPlaced", "min"), last=("CallPlaced", "max")
+    )
+    sums = intervals.groupby("VinNumber").agg(
+        intervals=("interval", "size"),
+        interval_sum=("interval", "sum"),
+        shortest=("interval", "min"),
+        latest=("interval", "last"),
+        sx=("position", "sum"),
+        sxy=("xy", "sum"),
+        sxx=("xx", "sum"),
+    )
+    denominator = sums["intervals"] * sums["sxx"] - sums["sx"] ** 2
+    sums["slope"] = (
+        sums["intervals"] * sums["sxy"] - sums["sx"] * sums["interval_sum"]
+    ) / denominator.where(denominator != 0)
+    per_vin = counts.join(sums, how="left")
+    per_vin["intervals"] = per_vin["intervals"].fillna(0).astype(int)
+    per_vin["interval_sum"] = per_vin["interval_sum"].fillna(0.0)
+
+    type_counts = frame.groupby(["VinNumber", "CallType"]).size()
+    type_intervals = dated.groupby(["VinNumber", "CallType"])["type_interval"].mean()
+    call_types = {}
+    for (vin, call_type), count in type_counts.items():
+        call_types.setdefault(vin, {})[call_type] = {
+            "tickets": int(count),
+            "repeats": int(count) - 1,
+            "mean_interval_days": _days(type_intervals.get((vin, call_type), np.nan)),
+        }
+
+    stats = {}
+    for row in per_vin.itertuples():
+        stats[row.Index] = _stats(
+            row.tickets, row.first, row.last, row.intervals, row.interval_sum,
+            row.shortest, row.latest, row.slope, call_types.get(row.Index, {}),
+        )
+    return stats
+
+
+def _stats(tickets, first, last, intervals, interval_sum, shortest, latest, slope, call_types):
+    mtbf = interval_sum / intervals if intervals else None
+    return {
+        "tickets": int(tickets),
+        "first_call": _date(first),
+        "last_call": _date(last),
+        "intervals": int(intervals),
+        "interval_sum_days": float(interval_sum),
+        "mtbf_days": _days(mtbf),
+        "shortest_interval_days": _days(shortest),
+        "latest_interval_days": _days(latest),
+        "trend": _trend(slope, mtbf, intervals),
+        "call_types": call_types,
+    }
+
+
+def events_stats(events):
+    """compute_vin_stats for one machine's ticket records, without building a frame.
+
+    Used for incremental updates, where pandas overhead would dominate the
+    handful of tickets a single machine has.
+    """
+    dated = sorted((e for e in events if pd.notna(e["CallPlaced"])), key=lambda e: e["CallPlaced"])
+    intervals = [
+        (later["CallPlaced"] - earlier["CallPlaced"]).total_seconds() / 86400
+        for earlier, later in zip(dated, dated[1:])
+    ]
+    n = len(intervals)
+    sx = sum(range(n))
+    sxx = sum(position * position for position in range(n))
+    sxy = sum(position * interval for position, interval in enumerate(intervals))
+    denominator = n * sxx - sx * sx
+    slope = (n * sxy - sx * sum(intervals)) / denominator if denominator else np.nan
+
+    call_types = {}
+    previous = {}
+    type_intervals = {}
+    for event in events:
+        call_type = event["CallType"]
+        if call_type is None or (isinstance(call_type, float) and pd.isna(call_type)):
+            continue
+        call_types[call_type] = call_types.get(call_type, 0) + 1
+    for event in dated:
+        call_type = event["CallType"]
+        if call_type in previous:
+            type_intervals.setdefault(call_type, []).append(
+                (event["CallPlaced"] - previous[call_type]).total_seconds() / 86400
+            )
+        previous[call_type] = event["CallPlaced"]
+    recurrence = {
+        call_type: {
+            "tickets": count,
+            "repeats": count - 1,
+            "mean_interval_days": _days(
+                sum(type_intervals[call_type]) / len(type_intervals[call_type])
+                if call_type in type_intervals else np.nan
+            ),
+        }
+        for call_type, count in call_types.items()
+    }
+    return _stats(
+        len(events),
+        dated[0]["CallPlaced"] if dated else pd.NaT,
+        dated[-1]["CallPlaced"] if dated else pd.NaT,
+        n,
+        sum(intervals),
+        min(intervals) if intervals else np.nan,
+        intervals[-1] if intervals else np.nan,
+        slope,
+        recurrence,
+    )
+
+
+class TicketAnalytics:
+    """Ticket recurrence and MTBF per VIN and fleet-wide.
+
+    Everything is computed once at load. A new ticket only recomputes its
+    own machine's statistics and swaps that machine's contribution in the
+    fleet totals, so neither update nor lookup rescans the fleet history.
+    """
+
+    def __init__(self):
+        self._events = {}
+        self._stats = {}
+        self._versions = {}
+        self._monthly = {}
+        self._lock = threading.Lock()
+        self._reset_fleet()
+        self.load_seconds = 0.0
+        self.updates = 0
+
+    def _reset_fleet(self):
+        self._fleet = {"tickets": 0, "vins": 0, "repeat_vins": 0, "interval_sum": 0.0, "intervals": 0}
+        # CallType -> {"tickets", "vins", "recurring_vins"}
+        self._fleet_types = {}
+
+    def _contribute(self, stats, sign):
+        # Caller holds the lock
+        self._fleet["tickets"] += sign * stats["tickets"]
+        self._fleet["vins"] += sign
+        self._fleet["repeat_vins"] += sign * (stats["tickets"] > 1)
+        self._fleet["interval_sum"] += sign * stats["interval_sum_days"]
+        self._fleet["intervals"] += sign * stats["intervals"]
+        for call_type, recurrence in stats["call_types"].items():
+            totals = self._fleet_types.setdefault(call_type, {"tickets": 0, "vins": 0, "recurring_vins": 0})
+            totals["tickets"] += sign * recurrence["tickets"]
+            totals["vins"] += sign
+            totals["recurring_vins"] += sign * (recurrence["repeats"] > 0)
+
+    def load(self, tickets):
+        start = time.perf_counter()
+        frame = tickets[COLUMNS]
+        stats = compute_vin_stats(frame)
+        monthly = frame["CallPlaced"].dropna().dt.strftime("%Y-%m").value_counts().to_dict()
+        events = {}
+        for record in frame.to_dict("records"):
+            events.setdefault(record["VinNumber"], []).append(record)
+        with self._lock:
+            self._events = events
+            self._stats = stats
+            self._versions = {vin: 0 for vin in stats}
+            self._monthly = monthly
+            self._reset_fleet()
+            for vin_stats in stats.values():
+                self._contribute(vin_stats, 1)
+        self.load_seconds = time.perf_counter() - start
+
+    def add_ticket(self, record):
+        """Fold one new ticket into its machine's statistics and the fleet totals."""
+        record = {column: record.get(column) for column in COLUMNS}
+        record["VinNumber"] = str(record["VinNumber"])
+        if isinstance(record["CallPlaced"], str):
+            record["CallPlaced"] = pd.to_datetime(record["CallPlaced"], format="%d-%m-%Y", errors="coerce")
+        vin = record["VinNumber"]
+        with self._lock:
+            events = self._events.setdefault(vin, [])
+            events.append(record)
+            vin_stats = events_stats(events)
+            if vin in self._stats:
+                self._contribute(self._stats[vin], -1)
+            self._stats[vin] = vin_stats
+            self._contribute(vin_stats, 1)
+            self._versions[vin] = self._versions.get(vin, 0) + 1
+            if pd.notna(record["CallPlaced"]):
+                month = record["CallPlaced"].strftime("%Y-%m")
+                self._monthly[month] = self._monthly.get(month, 0) + 1
+            self.updates += 1
+
+    # Reads
+    def version(self, vin):
+        with self._lock:
+            return self._versions.get(vin, 0)
+
+    def vin_stats(self, vin):
+        with self._lock:
+            stats = self._stats.get(vin)
+            if stats is None:
+                return None
+            stats = dict(stats)
+        stats.pop("interval_sum_days")
+        return stats
+
+    def fleet_stats(self):
+        with self._lock:
+            fleet = dict(self._fleet)
+            types = {call_type: dict(totals) for call_type, totals in self._fleet_types.items()}
+            monthly = dict(sorted(self._monthly.items()))
+        recent = list(monthly.values())[-FLEET_TREND_MONTHS:]
+        slope = np.polyfit(range(len(recent)), recent, 1)[0] if len(recent) > 1 else None
+        return {
+            "tickets": fleet["tickets"],
+            "vins": fleet["vins"],
+            "vins_with_repeat_failures": fleet["repeat_vins"],
+            "mtbf_days": _days(fleet["interval_sum"] / fleet["intervals"]) if fleet["intervals"] else None,
+            "call_types": {
+                call_type: {
+                    **totals,
+                    "recurrence_rate": round(totals["recurring_vins"] / totals["vins"], 3) if totals["vins"] else 0.0,
+                }
+                for call_type, totals in sorted(types.items())
+                if totals["vins"]
+            },
+            "monthly_tickets": monthly,
+            "tickets_per_month_trend": None if slope is None else round(float(slope), 2),
+            "load_seconds": self.load_seconds,
+            "incremental_updates": self.updates,
+        }
+
+    def summary(self, vin):
+        """Plain-text recurrence analysis for the ticket prompt, or None without tickets.
+
+        Only this machine's figures are included, so the text changes exactly
+        when version(vin) does; fleet comparisons are served by fleet_stats().
+        """
+        stats = self.vin_stats(vin)
+        if stats is None:
+            return None
+        details = [f"{stats['tickets']} tickets"]
+        if stats["first_call"] is not None:
+            details[0] += f" between {stats['first_call']} and {stats['last_call']}"
+        # Intervals are only defined once a machine has two dated tickets
+        if stats["mtbf_days"] is not None:
+            details.append(
+                f"MTBF {stats['mtbf_days']} days, "
+                f"shortest interval {stats['shortest_interval_days']} days, "
+                f"latest interval {stats['latest_interval_days']} days"
+            )
+        details.append(f"trend: {stats['trend']}")
+        lines = ["; ".join(details)]
+        for call_type, recurrence in sorted(stats["call_types"].items()):
+            interval = recurrence["mean_interval_days"]
+            lines.append(
+                f"{call_type}: {recurrence['tickets']} tickets, {recurrence['repeats']} repeats"
+                + (f", mean interval {interval} days" if interval is not None else "")
+            )
+        return "\n".join(lines)
+
+def build_ticket_analytics():
+    analytics = TicketAnalytics()
+    try:
+        analytics.load(load_tickets())
+    except FileNotFoundError as e:
+        print(f"Ticket analytics data not found: {e}")
+    return analytics
+
+
+ticket_analytics = build_ticket_analytics()
@@ -5,7 +5,14 @@ import json
 import threading
 import time
 import queue
-from datetime import datetime
+from collections import deque
+
+# Upper bound on messages kept in session state and on screen
+MAX_MESSAGES = 200
+# Number of recent samples kept for the parse/render cost metrics
+MAX_TIMING_SAMPLES = 500
+# How long the receiver blocks waiting for a message before re-checking state
+RECEIVE_TIMEOUT = 1.0
 
 # Create a thread-safe queue for message passing
 if 'message_queue' not in st.session_state:
@@ -16,10 +23,19 @@ if 'connected' not in st.session_state:
     st.session_state.connected = False
 
 if 'messages' not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.messages = deque(maxlen=MAX_MESSAGES)
+
+if 'ws_thread' not in st.session_state:
+    st.session_state.ws_thread = None
+
+if 'stop_event' not in st.session_state:
+    st.session_state.stop_event = threading.Event()
 
-if 'thread_running' not in st.session_state:
-    st.session_state.thread_running = False
+if 'timings' not in st.session_state:
+    st.session_state.timings = {
+        "parse": deque(maxlen=MAX_TIMING_SAMPLES),
+        "render": deque(maxlen=MAX_TIMING_SAMPLES),
+    }
 
 # Set page configuration
 st.set_page_config(page_title="Agent Metrics", page_icon="📊")
@@ -36,123 +52,174 @@ with col1:
     connect_button = st.button("Connect", type="primary", use_container_width=True)
 with col2:
     disconnect_button = st.button("Disconnect", type="secondary", use_container_width=True)
-with col3:
-    status_text = "Connected" if st.session_state.connected else "Disconnected"
-    st.write(f"Status: {status_text}")
+status_placeholder = col3.empty()
+
+
+def thread_alive():
+    thread = st.session_state.ws_thread
+    return thread is not None and thread.is_alive()
 
-# Message display area
-st.subheader("Messages")
-message_container = st.empty()
 
-# Function to display messages
-def update_message_display():
-    if st.session_state.messages:
-        messages_text = "\n\n".join(st.session_state.messages)
-        message_container.code(messages_text)
-    else:
-        message_container.write("No messages received yet.")
+def average_ms(samples):
+    return (sum(samples) / len(samples)) * 1000 if samples else 0.0
+
+
+def render_status():
+    status_text = "Connected" if st.session_state.connected else "Disconnected"
+    status_placeholder.write(f"Status: {status_text}")
 
-# Define global variables for thread communication
-stop_thread = False
 
 # Process for receiving websocket messages
-async def websocket_receiver(websocket, message_queue):
-    global stop_thread
-    try:
-        while not stop_thread:
-            try:
-                # Set timeout to check connection state periodically
-                message = await asyncio.wait_for(websocket.recv(), timeout=1.0)
-                
-                # Process the message
-                try:
-                    # Try to parse as JSON for prettier display
-                    parsed_message = json.loads(message)
-                    message_content = json.dumps(parsed_message, indent=2)
-                except json.JSONDecodeError:
-                    message_content = message
-                
-                # Add to message queue for main thread to process
-                message_queue.put(message_content)
-                
-            except asyncio.TimeoutError:
-                # Just a timeout to check connection state
-                pass
-    except Exception as e:
-        message_queue.put(f"Error: {str(e)}")
-        return
+async def websocket_receiver(websocket, message_queue, stop_event):
+    while not stop_event.is_set():
+        try:
+            # Set timeout to check the stop flag periodically
+            message = await asyncio.wait_for(websocket.recv(), timeout=RECEIVE_TIMEOUT)
+        except asyncio.TimeoutError:
+            continue
+
+        # Only validate JSON; the raw text is displayed as-is instead of re-serialized
+        start = time.perf_counter()
+        try:
+            json.loads(message)
+            language = "json"
+        except (json.JSONDecodeError, TypeError):
+            language = None
+        parse_seconds = time.perf_counter() - start
+
+        # Add to message queue for main thread to process
+        message_queue.put((message, language, parse_seconds))
+
 
 # WebSocket connection function
-def websocket_thread(session_id, message_queue):
-    global stop_thread
-    stop_thread = False
-    
+def websocket_thread(session_id, message_queue, stop_event):
     async def connect_websocket():
         url = f"wss://metrics.studio.lyzr.ai/ws/{session_id}"
-        
+
         try:
             async with websockets.connect(url) as websocket:
                 # Add connection message to queue
-                message_queue.put(f"Connected to {url}")
-                
+                message_queue.put((f"Connected to {url}", None, 0.0))
+
                 # Start receiving messages
-                await websocket_receiver(websocket, message_queue)
-                
-        except websockets.exceptions.ConnectionClosedError:
-            message_queue.put("Connection closed by server")
+                await websocket_receiver(websocket, message_queue, stop_event)
+
+        except websockets.exceptions.ConnectionClosed:
+            message_queue.put(("Connection closed by server", None, 0.0))
         except Exception as e:
-            message_queue.put(f"Error: {str(e)}")
+            message_queue.put((f"Error: {str(e)}", None, 0.0))
 
     # Run the async function in the thread
     asyncio.run(connect_websocket())
 
+
 # Handle connection/disconnection
 if connect_button and not st.session_state.connected and session_id:
+    # Make sure a previous connection is fully torn down first
+    st.session_state.stop_event.set()
+    if thread_alive():
+        st.session_state.ws_thread.join(timeout=RECEIVE_TIMEOUT * 2)
+
     st.session_state.connected = True
-    st.session_state.messages = []  # Clear messages on new connection
-    
-    # Start WebSocket connection in a separate thread if not already running
-    if not st.session_state.thread_running:
-        thread = threading.Thread(
-            target=websocket_thread, 
-            args=(session_id, st.session_state.message_queue)
-        )
-        thread.daemon = True
-        thread.start()
-        st.session_state.thread_running = True
-    
-    st.rerun()
+    st.session_state.messages.clear()  # Clear messages on new connection
+    st.session_state.message_queue = queue.Queue()
+    st.session_state.stop_event = threading.Event()
+
+    thread = threading.Thread(
+        target=websocket_thread,
+        args=(session_id, st.session_state.message_queue, st.session_state.stop_event),
+    )
+    thread.daemon = True
+    thread.start()
+    st.session_state.ws_thread = thread
 
 if disconnect_button and st.session_state.connected:
     st.session_state.connected = False
-    stop_thread = True
-    st.session_state.thread_running = False
-    st.session_state.messages.append("Disconnected by user")
-    st.rerun()
+    # Signal the receiver; it notices within RECEIVE_TIMEOUT and closes the socket
+    st.session_state.stop_event.set()
+    st.session_state.messages.append(("Disconnected by user", None))
+
+render_status()
 
 # Clear messages button
 if st.button("Clear Messages"):
-    st.session_state.messages = []
-    st.rerun()
-
-# Process messages from the queue
-if st.session_state.connected:
-    # Check for new messages
-    try:
-        while not st.session_state.message_queue.empty():
-            message = st.session_state.message_queue.get(block=False)
-            st.session_state.messages.append(message)
-    except Exception:
-        pass
-
-# Display messages
-update_message_display()
-
-# Auto-refresh for live updates
-if st.session_state.connected:
-    refresh_placeholder = st.empty()
-    refresh_placeholder.write("Connection active... (auto-refreshing)")
-    
-    # Set auto-refresh timer (every 2 seconds)
-    time.sleep(2)
-    st.rerun()
\ No newline at end of file
+    st.session_state.messages.clear()
+
+
+# Message display area
+st.subheader("Messages")
+
+
+def message_panel():
+    """Render the buffered messages once, then append new arrivals as they come in.
+
+    Runs as part of the full app run, which user input interrupts as usual.
+
+    After MAX_MESSAGES new arrivals the log is cleared and rebuilt in place
+    from the ring buffer (dropping rows that fell out of it), so rendering
+    cost is constant per message instead of growing with session length.
+    """
+    messages = st.session_state.messages
+    timings = st.session_state.timings
+
+    empty_note = st.empty()
+    if not messages:
+        empty_note.write("No messages received yet.")
+    log_slot = st.empty()
+    metrics_line = st.empty()
+
+    def rebuild_log():
+        log = log_slot.container()
+        for text, language in messages:
+            log.code(text, language=language)
+        return log
+
+    log = rebuild_log()
+
+    appended = 0
+    while st.session_state.connected:
+        try:
+            text, language, parse_seconds = st.session_state.message_queue.get(
+                timeout=RECEIVE_TIMEOUT
+            )
+        except queue.Empty:
+            if not thread_alive():
+                # Receiver exited (server closed or error): refresh the whole page
+                st.session_state.connected = False
+                st.rerun()
+            # Heartbeat also lets Streamlit interrupt this run on user input
+            metrics_line.caption(
+                f"Connection active · {len(messages)} messages buffered · "
+                f"avg parse {average_ms(timings['parse']):.3f} ms · "
+                f"avg render {average_ms(timings['render']):.3f} ms"
+            )
+            continue
+
+        start = time.perf_counter()
+        empty_note.empty()
+        log.code(text, language=language)
+        timings["render"].append(time.perf_counter() - start)
+        timings["parse"].append(parse_seconds)
+        messages.append((text, language))
+
+        appended += 1
+        if appended >= MAX_MESSAGES:
+            # A scoped rerun is only allowed during fragment reruns, and this
+            # loop runs as part of the full app run
+            log_slot.empty()
+            log = rebuild_log()
+            appended = 0
+
+    # Drain anything that arrived before the receiver stopped
+    while not st.session_state.message_queue.empty():
+        text, language, _ = st.session_state.message_queue.get(block=False)
+        messages.append((text, language))
+        log.code(text, language=language)
+    metrics_line.caption(
+        f"{len(messages)} messages buffered · "
+        f"avg parse {average_ms(timings['parse']):.3f} ms · "
+        f"avg render {average_ms(timings['render']):.3f} ms"
+    )
+
+
+message_panel()